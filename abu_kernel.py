@@ -0,0 +1,41 @@
+"""Closed-form abundance mapping solution
+
+Generated by progenitors.generate_abu_kernel() -- do not edit.
+All arguments may be scalars or numpy arrays (one entry per zone)
+"""
+
+
+def abu_det(A_ni, A_fe, A_cr, Z_ni, Z_fe, Z_cr):
+    return (-A_cr*Z_fe + A_cr*Z_ni + A_fe*Z_cr - A_fe*Z_ni - A_ni*Z_cr + A_ni*Z_fe)/(A_cr*A_fe*A_ni)
+
+
+def solve_abu(sumX_j, Y_ej, sumY_j, Y_e, Abar, A_ni, A_fe, A_cr, Z_ni, Z_fe, Z_cr):
+    x0 = A_fe*Z_cr
+    x1 = Abar*Z_fe
+    x2 = A_fe*Abar
+    x3 = Y_ej*x2
+    x4 = Y_e*x2
+    x5 = sumX_j*x1
+    x6 = A_cr*Z_fe
+    x7 = Abar*sumY_j
+    x8 = Abar*Z_cr
+    x9 = A_cr*Abar
+    x10 = Y_e*x9 - Y_ej*x9 + sumX_j*x8 - x8
+    x11 = A_fe*Z_ni
+    x12 = A_ni*Z_fe
+    x13 = A_ni*Z_cr
+    x14 = A_cr*Z_ni
+    x15 = x13 - x14
+    x16 = 1/(Abar*(-x0 + x11 - x12 + x15 + x6))
+    x17 = Abar*Z_ni
+    x18 = A_ni*Abar
+    x19 = -Y_e*x18 + Y_ej*x18 - sumX_j*x17 + x17
+    return A_ni*x16*(A_cr*Z_fe + A_fe*Abar*Z_cr*sumY_j - x0 - x1 - x10 - x3 + x4 + x5 - x6*x7), A_fe*x16*(x10 - x13*x7 + x14*x7 + x15 + x19), A_cr*x16*(A_fe*Z_ni + A_ni*Abar*Z_fe*sumY_j + x1 - x11*x7 - x12 - x19 + x3 - x4 - x5)
+
+
+def solve_abu_fixed_ni(X_ni, sumX_j, Y_ej, Y_e, A_ni, A_fe, A_cr, Z_ni, Z_fe, Z_cr):
+    x0 = A_ni*Z_cr
+    x1 = A_cr*A_ni
+    x2 = 1/(A_ni*(A_cr*Z_fe - A_fe*Z_cr))
+    x3 = A_ni*Z_fe
+    return A_fe*x2*(-A_cr*X_ni*Z_ni + X_ni*x0 + Y_e*x1 - Y_ej*x1 + sumX_j*x0 - x0), A_cr*x2*(-A_fe*A_ni*Y_e + A_fe*A_ni*Y_ej + A_fe*X_ni*Z_ni + A_ni*Z_fe - X_ni*x3 - sumX_j*x3)
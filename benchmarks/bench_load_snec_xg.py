@@ -0,0 +1,90 @@
+"""Benchmark snec.load_snec_xg against the original line-by-line loader
+
+Usage (from the directory containing ccsn/):
+    python -m ccsn.benchmarks.bench_load_snec_xg [filepath]
+
+If no .xg file is given, a synthetic one is written to a temporary directory.
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+from ccsn import snec
+
+
+def load_snec_xg_lines(filepath):
+    """Original line-by-line .xg loader, kept as the benchmark reference
+    """
+    profile = {}
+    with open(filepath, 'r') as rf:
+        for line in rf:
+            cols = line.split()
+
+            if 'Time' in line:
+                timesteps = float(cols[-1])
+                profile[timesteps] = []
+            elif len(cols) == 2:
+                profile[timesteps].append(np.fromstring(line, sep=' '))
+            else:
+                profile[timesteps] = np.array(profile[timesteps])
+
+    return profile
+
+
+def write_synthetic_xg(filepath, n_time=2000, n_mass=1000):
+    """Write a synthetic SNEC .xg file with the given shape
+    """
+    mass_grid = np.linspace(1e33, 3e34, n_mass)
+    values = np.random.default_rng(0).random((n_time, n_mass)) * 1e9
+
+    with open(filepath, 'w') as f:
+        for i in range(n_time):
+            f.write(f'"Time = {i * 1e-2:.15E}\n')
+            rows = np.column_stack([mass_grid, values[i]])
+            np.savetxt(f, rows, fmt=' %.15E')
+            f.write('\n\n')
+
+
+def time_call(func, n_repeat=3):
+    """Returns best wall time of func() over n_repeat calls
+    """
+    times = []
+    for _ in range(n_repeat):
+        t0 = time.perf_counter()
+        func()
+        times += [time.perf_counter() - t0]
+    return min(times)
+
+
+def main(filepath=None, n_repeat=3):
+    tmp_dir = None
+    if filepath is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        filepath = os.path.join(tmp_dir.name, 'bench.xg')
+        write_synthetic_xg(filepath)
+
+    size_mb = os.path.getsize(filepath) / 1024**2
+    print(f'file: {filepath} ({size_mb:.1f} MB)')
+
+    new = snec.load_snec_xg(filepath, verbose=False)
+    old = load_snec_xg_lines(filepath)
+    for key in old:
+        if not np.array_equal(old[key], new[key]):
+            raise RuntimeError(f'loaders disagree at timestep {key}')
+
+    t_old = time_call(lambda: load_snec_xg_lines(filepath), n_repeat=n_repeat)
+    t_new = time_call(lambda: snec.load_snec_xg(filepath, verbose=False),
+                      n_repeat=n_repeat)
+
+    print(f'line loader:    {t_old:.3f} s')
+    print(f'chunked loader: {t_new:.3f} s')
+    print(f'speedup:        {t_old / t_new:.1f}x')
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
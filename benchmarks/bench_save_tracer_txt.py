@@ -0,0 +1,56 @@
+"""Benchmark trajectories.save_tracer_txt against np.savetxt
+
+Usage (from the directory containing ccsn/):
+    python -m ccsn.benchmarks.bench_save_tracer_txt [n_rows]
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+from ccsn import trajectories
+
+
+def time_call(func, n_repeat=3):
+    """Returns best wall time of func() over n_repeat calls
+    """
+    times = []
+    for _ in range(n_repeat):
+        t0 = time.perf_counter()
+        func()
+        times += [time.perf_counter() - t0]
+    return min(times)
+
+
+def main(n_rows=100000, n_cols=5, n_repeat=3):
+    n_rows = int(n_rows)
+    tracer = np.random.default_rng(0).random((n_rows, n_cols)) * 1e10
+    tracer[::97, 2] = np.nan
+
+    with tempfile.TemporaryDirectory() as tmp_path:
+        old_filepath = os.path.join(tmp_path, 'savetxt.dat')
+        new_filepath = os.path.join(tmp_path, 'save_tracer_txt.dat')
+
+        def run_old():
+            np.savetxt(old_filepath, tracer, fmt='%.10e', delimiter='    ')
+
+        def run_new():
+            trajectories.save_tracer_txt(new_filepath, tracer, fmt='%.10e',
+                                         delimiter='    ')
+
+        t_old = time_call(run_old, n_repeat=n_repeat)
+        t_new = time_call(run_new, n_repeat=n_repeat)
+
+        with open(old_filepath, 'rb') as f_old, open(new_filepath, 'rb') as f_new:
+            if f_old.read() != f_new.read():
+                raise RuntimeError('save_tracer_txt output differs from np.savetxt')
+
+    print(f'tracer shape:    ({n_rows}, {n_cols})')
+    print(f'np.savetxt:      {t_old:.3f} s')
+    print(f'save_tracer_txt: {t_new:.3f} s')
+    print(f'speedup:         {t_old / t_new:.1f}x')
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,121 @@
+"""Helpers shared by the binary caches (snec, stir_extract, progenitors,
+trajectories)
+"""
+import os
+import hashlib
+import numpy as np
+
+
+def file_fingerprint(filepath):
+    """Returns fingerprint string of a file (path, mtime and size),
+    used as a cache key. Raises FileNotFoundError if the file doesn't exist
+
+    parameters
+    ----------
+    filepath : str
+    """
+    stat = os.stat(filepath)
+    return f'{os.path.abspath(filepath)}:{stat.st_mtime_ns}:{stat.st_size}'
+
+
+def array_fingerprint(array):
+    """Returns fingerprint string of an array (shape, dtype and a hash of
+    its contents), used as a cache key
+
+    parameters
+    ----------
+    array : np.array
+    """
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha1(array.view(np.uint8)).hexdigest()
+    return f'{array.shape}:{array.dtype}:{digest}'
+
+
+def save_atomic(filepath, save_func, *args, **kwargs):
+    """Save to a temporary file and move into place, so that an interrupted
+    write never leaves a partial cache file
+
+    parameters
+    ----------
+    filepath : str
+    save_func : callable
+        e.g. np.save, called as save_func(file, *args, **kwargs)
+    """
+    tmp_filepath = f'{filepath}.tmp'
+    try:
+        with open(tmp_filepath, 'wb') as f:
+            save_func(f, *args, **kwargs)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+
+
+def load_cached_array(array_filepath, meta_filepath, key, build_func,
+                      mmap_mode='r'):
+    """Load an array and its metadata from a binary cache (.npy + .npz),
+    building and saving them if missing or out of date
+        Returns: array, meta
+            array : np.array, memory-mapped from the .npy if cached
+            meta : dict of np.arrays saved alongside in the .npz
+
+    The cache is valid while the 'key' saved in the .npz matches key
+    (e.g. a file_fingerprint of the source file). If the cache can't be
+    written (e.g. read-only directory), the built array is returned in memory
+
+    parameters
+    ----------
+    array_filepath : str
+    meta_filepath : str
+    key : str
+    build_func : callable
+        returns (array, meta) when the cache needs (re)building
+    mmap_mode : str or None
+        memory-map mode for the cached array (see np.load)
+    """
+    meta = load_cache_meta(meta_filepath, key=key)
+    if meta is not None and os.path.exists(array_filepath):
+        return np.load(array_filepath, mmap_mode=mmap_mode), meta
+
+    array, meta = build_func()
+    meta = {name: np.asarray(value) for name, value in meta.items()}
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(array_filepath)), exist_ok=True)
+        save_atomic(array_filepath, np.save, array)
+        save_cache_meta(meta_filepath, key=key, meta=meta)
+    except OSError:
+        return array, meta
+
+    return np.load(array_filepath, mmap_mode=mmap_mode), meta
+
+
+def load_cache_meta(meta_filepath, key):
+    """Returns dict of metadata saved in a cache .npz, or None if it is
+    missing or its key doesn't match
+
+    parameters
+    ----------
+    meta_filepath : str
+    key : str
+    """
+    if not os.path.exists(meta_filepath):
+        return None
+
+    with np.load(meta_filepath) as f:
+        if 'key' not in f.files or str(f['key']) != key:
+            return None
+        return {name: f[name] for name in f.files if name != 'key'}
+
+
+def save_cache_meta(meta_filepath, key, meta):
+    """Save metadata of a cache entry, with its key
+
+    parameters
+    ----------
+    meta_filepath : str
+    key : str
+    meta : {str: array-like}
+    """
+    save_atomic(meta_filepath, np.savez, key=key, **meta)
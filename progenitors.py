@@ -1,24 +1,113 @@
 import numpy as np
 import os
+import functools
+import importlib.util
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import matplotlib.pyplot as plt
 
+# local
+try:
+    from .caching import file_fingerprint, load_cached_array
+except ImportError:  # imported as a top-level module
+    from caching import file_fingerprint, load_cached_array
+
 prog_path = '/Users/zac/projects/data/progenitors/sukhbold_2018/mdotone'
 
+# memoized sums/mapping by object identity, see memoize()
+memo_cache = OrderedDict()
+memo_size = 64
+
+# generated closed-form abundance solver (see generate_abu_kernel)
+abu_kernel_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'abu_kernel.py')
+
+# (Z, A) of the isotopes set by map_abu
+mapped_isotopes = {'ni56': (28, 56), 'fe56': (26, 56), 'cr56': (24, 56)}
+
 
-def load_prog(mass, path=None, skiprows=3):
+def load_prog(mass, path=None, skiprows=3, columns=None, cache=True):
     """Load progenitor model
 
     mass : flt
     path : str
     skiprows : int
+    columns : [str]
+        only return these columns (default: all)
+    cache : bool
+        load via the binary progenitor store (see load_prog_table)
+    """
+    if not cache:
+        prog = read_prog(prog_filepath(mass, path=path), skiprows=skiprows)
+        if columns is not None:
+            prog = prog[list(columns)]
+        return prog
+
+    table, all_columns, dtypes = load_prog_table(mass, path=path, skiprows=skiprows)
+    col_idxs = {col: i for i, col in enumerate(all_columns)}
+
+    if columns is None:
+        columns = all_columns
+
+    return pd.DataFrame({col: table[:, col_idxs[col]].astype(dtypes[col_idxs[col]],
+                                                             copy=False)
+                         for col in columns})
+
+
+def read_prog(filepath, skiprows=3):
+    """Parse progenitor model from text file
+
+    filepath : str
+    skiprows : int
     """
-    filepath = prog_filepath(mass, path=path)
     prog = pd.read_csv(filepath, skiprows=skiprows, delim_whitespace=True)
     prog.rename(columns={'neutrons': 'Neutrons'}, inplace=True)  # consistent capitalise
     return prog
 
 
+def load_prog_table(mass, path=None, skiprows=3):
+    """Return progenitor as a memory-mapped float64 array, with its column
+    names and original column dtypes. The text file is converted once to a
+    column-major .npy in {path}/cache, which is rebuilt if the text file's
+    mtime or size changes. If the cache can't be written (e.g. read-only
+    data directory), the parsed table is kept in memory instead.
+    The most recently used models are kept open in memory
+        Returns: table, columns, dtypes
+
+    mass : flt
+    path : str
+    skiprows : int
+    """
+    filepath = prog_filepath(mass, path=path)
+    stat = os.stat(filepath)
+    return load_prog_table_cached(filepath, skiprows=skiprows,
+                                  mtime=stat.st_mtime_ns, size=stat.st_size)
+
+
+@functools.lru_cache(maxsize=16)
+def load_prog_table_cached(filepath, skiprows, mtime, size):
+    """LRU-cached part of load_prog_table, keyed by file mtime and size
+    """
+    path, filename = os.path.split(filepath)
+    cache_path = os.path.join(path, 'cache')
+    table_filepath = os.path.join(cache_path, filename.replace('.dat', '.npy'))
+    meta_filepath = os.path.join(cache_path, filename.replace('.dat', '.meta.npz'))
+    key = f'{file_fingerprint(filepath)}:{skiprows}'
+
+    def build():
+        prog = read_prog(filepath, skiprows=skiprows)
+        table = np.asfortranarray(prog.to_numpy(dtype=np.float64))
+        meta = {'columns': np.array(prog.columns, dtype=str),
+                'dtypes': np.array([str(dtype) for dtype in prog.dtypes])}
+        return table, meta
+
+    table, meta = load_cached_array(table_filepath, meta_filepath, key=key,
+                                    build_func=build)
+
+    return table, tuple(meta['columns'].tolist()), tuple(meta['dtypes'].tolist())
+
+
 def prog_filename(mass):
     """Return progenitor filename for given mass
 
@@ -110,46 +199,337 @@ def plot_summary(prog, net, ye=None, abar=None, vline=None):
 # ================================================================
 #       Abundance Mapping
 # ================================================================
-def map_abu(prog, net_0, net, sums_0=None, sums=None):
-    """
+def map_abu(prog, net_0, net, sums_0=None, sums=None, method='solve', clip=True,
+            isotopes=None):
+    """Map the abundances of the original network onto three isotopes
+    (by default ni56, fe56 and cr56)
+        Returns: dict of per-zone arrays for each isotope, and
+            'negative' (bool), flagging zones where the solution went negative
+
     net_0 : table of isotopes *not* being mapped
+    method : 'solve' or 'fill'
+        'solve': choose the isotopes to conserve sumX, Ye and Abar, using
+            the closed-form solution from abu_kernel (see solve_abu)
+        'fill': copy the first two isotopes from prog, and fill the
+            remainder with the third
+    clip : bool
+        set negative abundances to zero. Clipped zones (flagged in
+        'negative') no longer conserve sumX and Ye
+    isotopes : {str: (Z, A)}
+        the three isotopes to map onto, in order (defaults to mapped_isotopes)
     """
-    abu = {}
+    if isotopes is None:
+        isotopes = mapped_isotopes
+
     sums_0 = check_sums(sums_0, prog=prog, net=net_0)
     sums = check_sums(sums, prog=prog, net=net)
 
-    abu['ni56'] = prog['Ni56']
-    abu['fe56'] = prog['Fe56']
-    abu['cr56'] = (1 - sums_0['sumx'])
+    if method == 'solve':
+        abu = solve_abu(prog, sums_0=sums_0, isotopes=isotopes)
+    elif method == 'fill':
+        iso_1, iso_2, iso_3 = isotopes
+        abu = {iso_1: prog[iso_1.capitalize()],
+               iso_2: prog[iso_2.capitalize()],
+               iso_3: (1 - sums_0['sumx'])}
+    else:
+        raise ValueError(f"method must be 'solve' or 'fill', not '{method}'")
 
     for key, val in abu.items():
-        abu[key] = np.array(val)
+        abu[key] = np.array(val, dtype=float)
+
+    negative = np.zeros(len(prog), dtype=bool)
+    for key in isotopes:
+        negative |= (abu[key] < 0)
+
+    if clip:
+        for key in isotopes:
+            abu[key] = np.clip(abu[key], 0, None)
+
+    abu['negative'] = negative
 
     return abu
 
 
+def solve_abu(prog, sums_0, isotopes=None):
+    """Solve for the three mapped isotopes in all zones at once, conserving
+    the provided sumX (=1), Ye and Abar
+        Returns: dict of per-zone arrays for each isotope
+
+    If the three isotopes share the same A (as ni56, fe56, cr56 do), the
+    Abar condition is the sumX condition divided by A, and the system is
+    degenerate. The first isotope is then kept at its provided abundance
+    (e.g. Ni56), and the other two are solved from sumX and Ye.
+
+    sums_0 : dict
+        sums of the isotopes *not* being mapped (see get_sums)
+    isotopes : {str: (Z, A)}
+        the three isotopes to solve for, in order (defaults to mapped_isotopes)
+    """
+    if isotopes is None:
+        isotopes = mapped_isotopes
+    if len(isotopes) != 3:
+        raise ValueError(f'need exactly three isotopes to solve for, '
+                         f'got {list(isotopes)}')
+
+    kernel = load_abu_kernel()
+    names = list(isotopes)
+    z = [float(isotopes[name][0]) for name in names]
+    a = [float(isotopes[name][1]) for name in names]
+
+    sumx_j = np.asarray(sums_0['sumx'], dtype=float)
+    ye_j = np.asarray(sums_0['ye'], dtype=float)
+    ye = prog['Ye'].to_numpy(dtype=float)
+
+    # kernel arguments are named after the default ni56, fe56, cr56
+    if abs(kernel.abu_det(*a, *z)) > 1e-12:
+        x = kernel.solve_abu(sumx_j, ye_j, np.asarray(sums_0['sumy'], dtype=float),
+                             ye, prog['Abar'].to_numpy(dtype=float), *a, *z)
+    else:
+        x_1 = prog[names[0].capitalize()].to_numpy(dtype=float)
+        x = (x_1,) + tuple(kernel.solve_abu_fixed_ni(x_1, sumx_j, ye_j, ye, *a, *z))
+
+    return dict(zip(names, x))
+
+
+@functools.lru_cache(maxsize=1)
+def load_abu_kernel(filepath=None):
+    """Return the compiled abundance solver module, generating it
+    (requires sympy) only if it doesn't exist yet
+
+    filepath : str
+        defaults to abu_kernel_path
+    """
+    if filepath is None:
+        filepath = abu_kernel_path
+
+    if not os.path.exists(filepath):
+        generate_abu_kernel(filepath)
+
+    spec = importlib.util.spec_from_file_location('abu_kernel', filepath)
+    kernel = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(kernel)
+
+    return kernel
+
+
+def generate_abu_kernel(filepath=None):
+    """Derive the closed-form solution of the abundance mapping (as in
+    abumap.ipynb) with sympy, and write it out as a plain numpy module
+
+    Unknowns X_ni, X_fe, X_cr satisfy, zone by zone:
+        sumX:  X_ni + X_fe + X_cr = 1 - sumX_j
+        Ye:    (Z/A)_ni X_ni + (Z/A)_fe X_fe + (Z/A)_cr X_cr = Y_e - Y_ej
+        Abar:  X_ni/A_ni + X_fe/A_fe + X_cr/A_cr = 1/Abar - sumY_j
+    where _j quantities are summed over the isotopes not being mapped.
+
+    filepath : str
+        defaults to abu_kernel_path
+    """
+    import sympy
+
+    if filepath is None:
+        filepath = abu_kernel_path
+
+    Abar, Ye = sympy.symbols('Abar Y_e')
+    Yej, sumXj, sumYj = sympy.symbols('Y_ej sumX_j sumY_j')
+    Xni, Xfe, Xcr = sympy.symbols('X_ni X_fe X_cr')
+    Ani, Afe, Acr = sympy.symbols('A_ni A_fe A_cr')
+    Zni, Zfe, Zcr = sympy.symbols('Z_ni Z_fe Z_cr')
+    isotopes = [Ani, Afe, Acr, Zni, Zfe, Zcr]
+
+    eq_sumx = sympy.Eq(Xni + Xfe + Xcr, 1 - sumXj)
+    eq_ye = sympy.Eq(Zni/Ani * Xni + Zfe/Afe * Xfe + Zcr/Acr * Xcr, Ye - Yej)
+    eq_sumy = sympy.Eq(Xni/Ani + Xfe/Afe + Xcr/Acr, 1/Abar - sumYj)
+
+    matrix, _ = sympy.linear_eq_to_matrix([eq_sumx, eq_ye, eq_sumy], [Xni, Xfe, Xcr])
+    det = sympy.factor(matrix.det())
+
+    full = sympy.solve([eq_sumx, eq_ye, eq_sumy], [Xni, Xfe, Xcr], dict=True)[0]
+    fixed_ni = sympy.solve([eq_sumx, eq_ye], [Xfe, Xcr], dict=True)[0]
+
+    lines = ['"""Closed-form abundance mapping solution',
+             '',
+             'Generated by progenitors.generate_abu_kernel() -- do not edit.',
+             'All arguments may be scalars or numpy arrays (one entry per zone)',
+             '"""',
+             '']
+    lines += kernel_function('abu_det', args=isotopes, exprs=[det])
+    lines += kernel_function('solve_abu', args=[sumXj, Yej, sumYj, Ye, Abar] + isotopes,
+                             exprs=[full[Xni], full[Xfe], full[Xcr]])
+    lines += kernel_function('solve_abu_fixed_ni', args=[Xni, sumXj, Yej, Ye] + isotopes,
+                             exprs=[fixed_ni[Xfe], fixed_ni[Xcr]])
+
+    tmp_filepath = f'{filepath}.tmp'
+    with open(tmp_filepath, 'w') as f:
+        f.write('\n'.join(lines))
+    os.replace(tmp_filepath, filepath)
+
+
+def kernel_function(name, args, exprs):
+    """Return source lines of a function evaluating the given sympy
+    expressions, with common subexpressions pulled out
+
+    name : str
+    args : [sympy.Symbol]
+    exprs : [sympy.Expr]
+    """
+    import sympy
+    from sympy.printing.pycode import pycode
+
+    replacements, reduced = sympy.cse([sympy.simplify(e) for e in exprs])
+
+    lines = ['', f"def {name}({', '.join(str(arg) for arg in args)}):"]
+    for sym, expr in replacements:
+        lines += [f'    {sym} = {pycode(expr)}']
+
+    returns = ', '.join(pycode(expr) for expr in reduced)
+    lines += [f'    return {returns}', '']
+
+    return lines
+
+
 def get_sums(prog, net):
     """net : table of isotopes to sum over
+
+    Computes sumx, ye and sumy as a single matrix product of the
+    (n_zones, n_iso) mass fraction matrix with weight vectors 1, Z/A and 1/A
     """
-    out = {}
-    n_zones = len(prog)
-    for key in ['sumx', 'ye', 'sumy']:
-        out[key] = np.zeros(n_zones)
+    columns, weights = get_net_weights(prog_columns=tuple(prog.columns),
+                                       isotopes=tuple(net['isotope']),
+                                       z=tuple(net['Z']), a=tuple(net['A']))
 
-    for row in net.itertuples():
-        iso = row.isotope.capitalize()
-        x_i = np.array(prog[iso])
+    x = prog[list(columns)].to_numpy(dtype=float)
+    sums = x @ weights
 
-        out['sumx'] += x_i
-        out['ye'] += x_i * (row.Z / row.A)
-        out['sumy'] += x_i / row.A
+    out = {}
+    for i, key in enumerate(['sumx', 'ye', 'sumy']):
+        out[key] = sums[:, i]
 
     return out
 
 
+@functools.lru_cache(maxsize=32)
+def get_net_weights(prog_columns, isotopes, z, a):
+    """Return progenitor columns and (n_iso, 3) weight matrix [1, Z/A, 1/A]
+    for the given network, cached per (prog columns, net)
+
+    prog_columns : tuple
+    isotopes, z, a : tuple
+        network isotope names, Z and A
+    """
+    columns = tuple(iso.capitalize() for iso in isotopes)
+    missing = [col for col in columns if col not in prog_columns]
+    if len(missing) > 0:
+        raise KeyError(f'isotopes missing from progenitor: {missing}')
+
+    z = np.array(z, dtype=float)
+    a = np.array(a, dtype=float)
+
+    weights = np.column_stack([np.ones_like(a), z / a, 1 / a])
+    weights.flags.writeable = False
+
+    return columns, weights
+
+
+def map_abu_batch(masses, net_0, net, path=None, n_workers=None):
+    """Load and map a set of progenitors in parallel worker processes
+        Returns: stacked, summary
+            stacked : dict of 1D arrays with all zones of all models
+                concatenated (see map_prog), plus 'offsets', where model i
+                is [offsets[i]:offsets[i+1]]
+            summary : pd.DataFrame of per-model diagnostics
+
+    masses : [flt]
+    net_0 : table of isotopes *not* being mapped
+    net : table of isotopes in the original network
+    path : str
+    n_workers : int
+        number of worker processes (defaults to number of cpus)
+    """
+    n_models = len(masses)
+    if n_models == 0:
+        raise ValueError('masses is empty, need at least one progenitor to map')
+
+    results = []
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        jobs = executor.map(map_prog, masses, [net_0] * n_models,
+                            [net] * n_models, [path] * n_models)
+
+        for i, result in enumerate(jobs):
+            print(f'\rmapping progenitor: {masses[i]} ({i+1}/{n_models})', end='')
+            results += [result]
+    print('')
+
+    n_zones = np.array([len(result['radius']) for result in results])
+    stacked = {'offsets': np.concatenate([[0], np.cumsum(n_zones)])}
+    for key in results[0]:
+        stacked[key] = np.concatenate([result[key] for result in results])
+
+    summary = pd.DataFrame([result_diagnostics(result) for result in results])
+    summary.insert(0, 'n_zones', n_zones)
+    summary.insert(0, 'mass', masses)
+
+    return stacked, summary
+
+
+def map_prog(mass, net_0, net, path=None):
+    """Load a single progenitor and map its abundances (worker for map_abu_batch)
+        Returns: dict of per-zone arrays:
+            'radius', 'ye_provided', 'sumx', 'ye', 'sumy' (original network),
+            'sumx_0', 'ye_0' (unmapped isotopes), 'ni56', 'fe56', 'cr56' (mapped),
+            'negative' (zones where the mapping went negative, see map_abu)
+    """
+    isotopes = set(net['isotope']) | set(net_0['isotope'])
+    columns = ['radius', 'Ye', 'Abar', 'Ni56', 'Fe56']
+    columns += sorted({iso.capitalize() for iso in isotopes} - set(columns))
+
+    prog = load_prog(mass, path=path, columns=columns)
+    sums = get_sums(prog, net=net)
+    sums_0 = get_sums(prog, net=net_0)
+    abu = map_abu(prog, net_0=net_0, net=net, sums_0=sums_0, sums=sums)
+
+    result = {'radius': prog['radius'].to_numpy(),
+              'ye_provided': prog['Ye'].to_numpy(),
+              'sumx': sums['sumx'],
+              'ye': sums['ye'],
+              'sumy': sums['sumy'],
+              'sumx_0': sums_0['sumx'],
+              'ye_0': sums_0['ye']}
+    result.update(abu)
+
+    return result
+
+
+def result_diagnostics(result):
+    """Return summary diagnostics of a single mapped progenitor (see map_prog)
+
+    max_sumx_err : max |1 - sumx| of original network
+    max_ye_err : max |ye - provided Ye| of original network
+    max_sumx_err_mapped : as max_sumx_err, after mapping
+    max_ye_err_mapped : as max_ye_err, after mapping
+    n_negative : number of zones where the mapping went negative
+    """
+    sumx_mapped = result['sumx_0'] + sum(result[key] for key in mapped_isotopes)
+    ye_mapped = result['ye_0'] + sum(result[key] * z / a
+                                     for key, (z, a) in mapped_isotopes.items())
+
+    return {'max_sumx_err': np.max(np.abs(1 - result['sumx'])),
+            'max_ye_err': np.max(np.abs(result['ye'] - result['ye_provided'])),
+            'max_sumx_err_mapped': np.max(np.abs(1 - sumx_mapped)),
+            'max_ye_err_mapped': np.max(np.abs(ye_mapped - result['ye_provided'])),
+            'n_negative': np.sum(result['negative'])}
+
+
 def plot_mapped_sumx(prog, net_0, net, mapped_abu=None, ax=None, vline=None,
                      hline=None, x_var=None, sums_0=None, sums=None, xlims=None,
                      legend=True):
+    """Plot mapped abundances and sumx before/after mapping
+
+    mapped_abu defaults to map_abu(), i.e. the closed-form solution with
+    negative abundances clipped. Clipped zones don't conserve sumx, and
+    are marked on the final curve
+    """
     x_var = check_xvar(x_var)
     sums_0 = check_sums(sums_0, prog=prog, net=net_0)
     sums = check_sums(sums, prog=prog, net=net)
@@ -157,14 +537,15 @@ def plot_mapped_sumx(prog, net_0, net, mapped_abu=None, ax=None, vline=None,
 
     ax = check_ax(ax)
 
-    for iso in ['ni56', 'fe56', 'cr56']:
+    for iso in mapped_isotopes:
         ax.plot(prog[x_var], mapped_abu[iso], label=f'{iso} (mapped)')
 
     ax.plot(prog[x_var], sums['sumx'], ls='--', label='sumx (original net19)')
     ax.plot(prog[x_var], sums_0['sumx'], ls='--', label='sumx (partial)')
 
-    sumx_final = sums_0['sumx'] + mapped_abu['ni56'] + mapped_abu['fe56'] + mapped_abu['cr56']
+    sumx_final = sums_0['sumx'] + sum(mapped_abu[iso] for iso in mapped_isotopes)
     ax.plot(prog[x_var], sumx_final, ls='--', label='sumx (final)')
+    add_negative(ax, vals=sumx_final, mapped_abu=mapped_abu, prog=prog, x_var=x_var)
 
     add_vline(ax, vline=vline, plot_type='x')
     add_hline(ax, hline=hline, prog=prog, x_var=x_var)
@@ -175,22 +556,28 @@ def plot_mapped_sumx(prog, net_0, net, mapped_abu=None, ax=None, vline=None,
 def plot_mapped_ye(prog, net_0, net, mapped_abu=None, ax=None, vline=None,
                    hline=None, x_var=None, sums_0=None, sums=None, xlims=None,
                    legend=True):
+    """Plot mapped contributions to Ye and Ye before/after mapping
+
+    mapped_abu defaults to map_abu(), i.e. the closed-form solution with
+    negative abundances clipped. Clipped zones don't conserve Ye, and are
+    marked on the final curve
+    """
     x_var = check_xvar(x_var)
     sums_0 = check_sums(sums_0, prog=prog, net=net_0)
     sums = check_sums(sums, prog=prog, net=net)
     mapped_abu = check_mapped_abu(mapped_abu, prog=prog, net_0=net_0, sums_0=sums_0, net=net)
     ax = check_ax(ax)
 
-    ax.plot(prog[x_var], mapped_abu['ni56'] * 28/56, label=f'ni56 (mapped)')
-    ax.plot(prog[x_var], mapped_abu['fe56'] * 26/56, label=f'fe56 (mapped)')
-    ax.plot(prog[x_var], mapped_abu['cr56'] * 24/56, label=f'cr56 (mapped)')
+    for iso, (z, a) in mapped_isotopes.items():
+        ax.plot(prog[x_var], mapped_abu[iso] * z / a, label=f'{iso} (mapped)')
 
     ax.plot(prog[x_var], prog['Ye'], ls='--', label='provided')
     ax.plot(prog[x_var], sums_0['ye'], ls='--', label='partial')
 
-    ye_final = sums_0['ye'] + mapped_abu['ni56'] * 28/56 + mapped_abu['fe56'] * 26/56 \
-                 + mapped_abu['cr56'] * 24/56
+    ye_final = sums_0['ye'] + sum(mapped_abu[iso] * z / a
+                                  for iso, (z, a) in mapped_isotopes.items())
     ax.plot(prog[x_var], ye_final, ls='--', label='final')
+    add_negative(ax, vals=ye_final, mapped_abu=mapped_abu, prog=prog, x_var=x_var)
 
     add_vline(ax, vline=vline, plot_type='x')
     add_hline(ax, hline=hline, prog=prog, x_var=x_var)
@@ -207,6 +594,18 @@ def add_calculated(ax, vals, prog, x_var=None, label='Calculated'):
         ax.plot(prog[x_var], vals, label=label)
 
 
+def add_negative(ax, vals, mapped_abu, prog, x_var=None):
+    """Mark zones where the mapping went negative (see map_abu)
+    """
+    x_var = check_xvar(x_var)
+    negative = mapped_abu.get('negative')
+
+    if negative is not None and np.any(negative):
+        x = np.array(prog[x_var])
+        ax.plot(x[negative], np.asarray(vals)[negative], ls='none', marker='x',
+                color='k', label='negative (clipped)')
+
+
 def add_vline(ax, vline, plot_type):
     if vline is not None:
         ylims = None
@@ -237,16 +636,62 @@ def check_xvar(x_var):
 
 def check_sums(sums, prog, net):
     if sums is None:
-        sums = get_sums(prog=prog, net=net)
+        sums = memoize('sums', (prog, net),
+                       lambda: get_sums(prog=prog, net=net))
     return sums
 
 
 def check_mapped_abu(mapped_abu, prog, net_0, sums_0, net):
     if mapped_abu is None:
-        mapped_abu = map_abu(prog=prog, net_0=net_0, sums_0=sums_0, net=net)
+        mapped_abu = memoize('abu', (prog, net_0, net, sums_0),
+                             lambda: map_abu(prog=prog, net_0=net_0,
+                                             sums_0=sums_0, net=net))
     return mapped_abu
 
 
+def get_mapping(prog, net_0, net):
+    """Return sums and mapped abundances of a progenitor, computed once per
+    (prog, net_0, net) and shared with the plotting helpers
+        Returns: dict with keys 'sums', 'sums_0', 'abu'
+    """
+    sums = check_sums(None, prog=prog, net=net)
+    sums_0 = check_sums(None, prog=prog, net=net_0)
+    abu = check_mapped_abu(None, prog=prog, net_0=net_0, sums_0=sums_0, net=net)
+    return {'sums': sums, 'sums_0': sums_0, 'abu': abu}
+
+
+def memoize(kind, objects, func):
+    """Return func(), memoized by the identity of the given objects
+
+    The most recent memo_size results are kept. Objects are held by the
+    cache, so their ids can't be reused while cached. If a progenitor or
+    network table is modified in place, call clear_memo()
+
+    kind : str
+        label for the cached quantity
+    objects : tuple
+        objects the result depends on (None entries are allowed)
+    func : callable
+    """
+    key = (kind,) + tuple(id(obj) for obj in objects)
+    if key in memo_cache:
+        memo_cache.move_to_end(key)
+        return memo_cache[key][1]
+
+    value = func()
+    memo_cache[key] = (objects, value)
+    if len(memo_cache) > memo_size:
+        memo_cache.popitem(last=False)
+
+    return value
+
+
+def clear_memo():
+    """Clear memoized sums and mapped abundances
+    """
+    memo_cache.clear()
+
+
 def check_ax(ax):
     if ax is None:
         fig, ax = plt.subplots(figsize=[8, 6])
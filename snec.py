@@ -3,91 +3,513 @@
 import numpy as np
 import sys
 import os
-from scipy.interpolate import interp1d
+import time
+import functools
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from scipy.interpolate import PchipInterpolator
 from astropy import units
 
 # flashbang
 from .strings import printv
 from . import trajectories
+from .caching import file_fingerprint, array_fingerprint, load_cached_array
 
 g2msun = units.g.to(units.Msun)
+snec_path = '/Users/zac/projects/data/snec/mass13/Data'
 
 
 def pipeline(n_tracers=100, n_skip=1, run='concat_stir_snec',
              path='/Users/zac/projects/codes/traj_code/data/concat',
-             snec_tracers=None):
+             snec_tracers=None, n_workers=1, use_threads=False,
+             save_npy=False, t_end=20, dt=0.01,
+             var_list=('temp', 'rho', 'radius', 'ye'), data_path=None,
+             force=False, cache_path=None):
     """Join and save tracers
+        Returns: dict of {tracer_i: error} for any tracers that failed
+
+    Only outdated tracers are rebuilt. A manifest ({run}_manifest.json in
+    path) records the inputs each output was built from (stir tracer file,
+    snec .xg files, n_skip, t_end, dt, var_list, save_npy). Outputs whose
+    inputs are unchanged (and whose .npy copy exists, if save_npy) are
+    skipped, so an interrupted run resumes where it stopped.
+    If snec_tracers is given, each tracer's snec input is recorded by a
+    hash of its snec_tracers[i] array instead of the .xg files.
+
+    parameters
+    ----------
+    n_workers : int
+        number of parallel workers (1 runs in serial)
+    use_threads : bool
+        use a thread pool instead of a process pool
+    save_npy : bool
+        also save a binary .npy copy of each tracer
+    t_end, dt, var_list, data_path
+        passed to build_snec_tracers (data_path as path). If snec_tracers
+        is given, it is assumed to have been built with these
+    force : bool
+        rebuild all tracers, even if up to date
+    cache_path : str
+        directory of the snec profile cache, passed to build_snec_tracers
     """
+    filepaths = [os.path.join(path, f'{run}_tracer{i}.dat') for i in range(n_tracers)]
+    manifest_filepath = os.path.join(path, f'{run}_manifest.json')
+    manifest = load_manifest(manifest_filepath)
+
+    params = {'n_skip': n_skip, 't_end': t_end, 'dt': dt,
+              'var_list': list(var_list), 'save_npy': save_npy}
+    if data_path is None:
+        data_path = snec_path
     if snec_tracers is None:
-        snec_tracers = build_snec_tracers()
+        snec_keys = {var: file_fingerprint(os.path.join(data_path, f'{var}.xg'))
+                     for var in var_list}
 
+    fingerprints = {}
     for i in range(n_tracers):
-        sys.stdout.write(f'\rJoin tracer {i+1}/{n_tracers}')
-        tracer = join_tracers(snec_tracers, mass_i=i, n_skip=n_skip)
+        stir_filepath = trajectories.stir_traj_filepath(i)
+        stir_key = None  # missing files are left to fail in save_joined_tracer
+        if os.path.exists(stir_filepath):
+            stir_key = file_fingerprint(stir_filepath)
+
+        if snec_tracers is not None:
+            snec_key = array_fingerprint(snec_tracers[i])
+        else:
+            snec_key = snec_keys
+
+        fingerprints[i] = {'stir': stir_key, 'snec': snec_key, **params}
+
+    def outdated(i):
+        if not os.path.exists(filepaths[i]):
+            return True
+        if save_npy and not os.path.exists(os.path.splitext(filepaths[i])[0] + '.npy'):
+            return True
+        return manifest.get(os.path.basename(filepaths[i])) != fingerprints[i]
 
-        filename = f'{run}_tracer{i}.dat'
-        filepath = os.path.join(path, filename)
-        np.savetxt(filepath, tracer, fmt='%.10e', delimiter='    ')
+    todo = [i for i in range(n_tracers) if force or outdated(i)]
+
+    sys.stdout.write(f'{n_tracers - len(todo)}/{n_tracers} tracers up to date\n')
+    if len(todo) == 0:
+        return {}
+
+    if snec_tracers is None:
+        snec_tracers = build_snec_tracers(t_end=t_end, dt=dt, n_traj=n_tracers,
+                                          var_list=var_list, path=data_path,
+                                          cache_path=cache_path)
+
+    failed = {}
+    save_time = time.time()
+
+    def report(count, i, error):
+        nonlocal save_time
+        sys.stdout.write(f'\rJoin tracer {count+1}/{len(todo)}')
+        filename = os.path.basename(filepaths[i])
+
+        if error is None:
+            manifest[filename] = fingerprints[i]
+        else:
+            manifest.pop(filename, None)
+            failed[i] = error
+            sys.stdout.write(f'\nFailed tracer {i}: {error}\n')
+
+        # save progress every few seconds, so an interrupted run can resume
+        if time.time() - save_time > 5:
+            save_manifest(manifest_filepath, manifest)
+            save_time = time.time()
+
+    try:
+        if n_workers == 1:
+            for count, i in enumerate(todo):
+                error = save_joined_tracer(i, snec_tracers[i], n_skip=n_skip,
+                                           filepath=filepaths[i],
+                                           save_npy=save_npy)
+                report(count, i, error)
+        else:
+            if use_threads:
+                executor = ThreadPoolExecutor(max_workers=n_workers)
+            else:
+                executor = ProcessPoolExecutor(max_workers=n_workers)
+
+            with executor:
+                futures = [executor.submit(save_joined_tracer, i, snec_tracers[i],
+                                           n_skip=n_skip, filepath=filepaths[i],
+                                           save_npy=save_npy)
+                           for i in todo]
+
+                # report in tracer order
+                for count, (i, future) in enumerate(zip(todo, futures)):
+                    try:
+                        error = future.result()
+                    except Exception as e:  # e.g. worker process died
+                        error = repr(e)
+                    report(count, i, error)
+    finally:
+        save_manifest(manifest_filepath, manifest)
 
     sys.stdout.write('\n')
+    if len(failed) > 0:
+        sys.stdout.write(f'{len(failed)}/{len(todo)} tracers failed\n')
+
+    return failed
+
 
+def load_manifest(filepath):
+    """Load pipeline manifest, returns empty dict if it doesn't exist
+
+    parameters
+    ----------
+    filepath : str
+    """
+    if not os.path.exists(filepath):
+        return {}
+    with open(filepath, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(filepath, manifest):
+    """Save pipeline manifest
+
+    parameters
+    ----------
+    filepath : str
+    manifest : {}
+    """
+    tmp_filepath = f'{filepath}.tmp'
+    with open(tmp_filepath, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_filepath, filepath)
 
-def join_tracers(snec_tracers, mass_i, n_skip=1):
+
+def save_joined_tracer(mass_i, snec_tracer, n_skip, filepath, save_npy=False):
+    """Join stir and snec tracer and save to file
+        Returns: None if successful, otherwise error string
+
+    Exceptions are caught and returned, so one bad tracer doesn't stop
+    the rest of the pipeline
+
+    parameters
+    ----------
+    mass_i : int
+    snec_tracer : 2D array
+        single tracer, i.e. snec_tracers[mass_i]
+    n_skip : int
+    filepath : str
+    save_npy : bool
+        also save a binary .npy copy (see trajectories.save_tracer_txt)
+    """
+    try:
+        stir_tracer = trajectories.load_stir_traj(mass_i)
+        tracer = join_tracer(stir_tracer, snec_tracer, n_skip=n_skip)
+        trajectories.save_tracer_txt(filepath, tracer, fmt='%.10e',
+                                     delimiter='    ', save_npy=save_npy)
+    except Exception as e:
+        return repr(e)
+
+
+def join_tracers(snec_tracers, mass_i, n_skip=1, stir_tracers=None, out=None,
+                 check=True):
     """Join stir and snec tracer
 
     snec_tracers
         as output by build_snec_tracers
+    stir_tracers
+        optional trajectories.StirTracers to take the stir tracer from,
+        otherwise it is loaded from file
+    out, check
+        see join_tracer
+    """
+    if stir_tracers is None:
+        stir_tracer = trajectories.load_stir_traj(mass_i)
+    else:
+        stir_tracer = stir_tracers[mass_i]
+    return join_tracer(stir_tracer, snec_tracers[mass_i], n_skip=n_skip,
+                       out=out, check=check)
+
+
+def join_tracer(stir_tracer, snec_tracer, n_skip=1, out=None, check=True):
+    """Join a single stir and snec tracer, shifting snec to stir time
+
+    Both segments are written straight into a single output array,
+    without intermediate copies
+
+    parameters
+    ----------
+    stir_tracer : 2D array
+    snec_tracer : 2D array
+    n_skip : int
+        number of initial snec timesteps to drop
+    out : 2D array
+        optional buffer to write into, with at least n_stir + n_snec - n_skip
+        rows. The filled rows are returned as a view
+    check : bool
+        check that the segments join cleanly (see check_join)
     """
-    stir_tracer = trajectories.load_stir_traj(mass_i)
-    snec_tracer = np.array(snec_tracers[mass_i, n_skip:, :])
+    snec_tracer = snec_tracer[n_skip:, :]
+    if check:
+        check_join(stir_tracer, snec_tracer)
+
+    n_stir = len(stir_tracer)
+    n_rows = n_stir + len(snec_tracer)
+    n_vars = stir_tracer.shape[1]
+
+    if out is None:
+        out = np.empty((n_rows, n_vars))
+    elif len(out) < n_rows or out.shape[1] != n_vars:
+        raise ValueError(f'out has shape {out.shape}, need at least '
+                         f'({n_rows}, {n_vars})')
 
-    t_offset = stir_tracer[-1, 0]
-    snec_tracer[:, 0] += t_offset  # shift to stir time
+    joined = out[:n_rows]
+    joined[:n_stir] = stir_tracer
+    joined[n_stir:] = snec_tracer
+    joined[n_stir:, 0] += stir_tracer[-1, 0]  # shift to stir time
 
-    return np.concatenate([stir_tracer, snec_tracer])
+    return joined
+
+
+def check_join(stir_tracer, snec_tracer):
+    """Raise ValueError if stir and snec tracers don't join cleanly:
+    mismatched columns, non-increasing time, or a duplicated boundary sample
+
+    parameters
+    ----------
+    stir_tracer : 2D array
+    snec_tracer : 2D array
+        snec tracer after dropping skipped timesteps, in snec time
+    """
+    if stir_tracer.shape[1] != snec_tracer.shape[1]:
+        raise ValueError(f'stir tracer has {stir_tracer.shape[1]} columns, '
+                         f'snec tracer has {snec_tracer.shape[1]}')
+
+    for name, tracer in (('stir', stir_tracer), ('snec', snec_tracer)):
+        if np.any(np.diff(tracer[:, 0]) <= 0):
+            raise ValueError(f'{name} tracer time is not strictly increasing')
+
+    if len(snec_tracer) > 0 and snec_tracer[0, 0] <= 0:
+        raise ValueError(f'first snec time ({snec_tracer[0, 0]}) would duplicate '
+                         'or precede the last stir time; increase n_skip')
 
 
 def build_snec_tracers(t_end=20, dt=0.01, n_traj=100,
-                       var_list=('temp', 'rho', 'radius', 'ye'), verbose=True):
+                       var_list=('temp', 'rho', 'radius', 'ye'), path=None,
+                       kind='linear', t_method='right', out=None, verbose=True,
+                       cache_path=None):
     """Build snec mass tracers to append to stir tracers
+        Returns: 3D np.array of shape (n_mass, n_time, n_vars + 1)
+
+    SNEC profiles are read from the .xg files in path, via the binary cache
+    (see load_snec_xg_cached)
+
+    parameters
+    ----------
+    kind : str
+        interpolation method (see map_snec_grid)
+    t_method : str
+        time resampling method (see resample_stencil). Repeated timesteps
+        are dropped, so the tracer time is strictly increasing
+    out : 3D array
+        optional buffer of shape (n_mass, n_time, n_vars + 1) to fill,
+        so that repeated builds don't allocate
+    cache_path : str
+        directory of the profile cache (see load_snec_xg_cached)
     """
     # Get reduced snec time grid
-    full_time_grid = load_snec_profile('time_grid')
-    sub_idxs = subset_idxs(t_end=t_end, dt=dt)
-    time_grid = full_time_grid[sub_idxs]
+    time_grid, t_idxs, t_weights = time_resampler(t_end=t_end, dt=dt, path=path,
+                                                  var=var_list[0],
+                                                  method=t_method,
+                                                  cache_path=cache_path,
+                                                  unique=True)
 
     mass_grid = trajectories.extract_stir_mass_grid(n_traj=n_traj)
 
-    # map snec profiles onto stir mass grid
-    map_profiles = dict.fromkeys(var_list)
-    for var in var_list:
-        map_profiles[var] = map_snec_grid(var, mass_grid=mass_grid)
-
     n_time = len(time_grid)
     n_mass = len(mass_grid)
     n_vars = len(var_list) + 1  # one extra for time
+    shape = (n_mass, n_time, n_vars)
 
-    tracers = np.full([n_mass, n_time, n_vars], np.nan)
+    if out is None:
+        tracers = np.full(shape, np.nan)
+    elif out.shape != shape:
+        raise ValueError(f'out has shape {out.shape}, expected {shape}')
+    else:
+        tracers = out
 
     printv('Building mass tracers from mapped profiles', verbose)
-    for i in range(n_mass):
-        tracers[i, :, 0] = time_grid
+    tracers[:, :, 0] = time_grid
 
-        for j, var in enumerate(var_list):
-            tracers[i, :, j+1] = map_profiles[var][:, i]
+    # map snec profiles straight into tracers
+    map_snec_vars(var_list, mass_grid=mass_grid, t_idxs=t_idxs,
+                  t_weights=t_weights, path=path, kind=kind,
+                  out=tracers[:, :, 1:], cache_path=cache_path)
 
     return tracers
 
 
-def load_snec_profile(var, path='/Users/zac/projects/data/snec/mass13/Data'):
+def map_snec_vars(var_list, mass_grid, t_idxs=None, t_weights=None, path=None,
+                  kind='linear', out=None, cache_path=None):
+    """Interpolate several snec profiles onto stir tracer mass grid,
+    sharing a single interpolation stencil
+        Returns: 3D np.array of shape (n_mass, n_time, n_vars)
+
+    parameters
+    ----------
+    var_list : [str]
+        profile variables to map (e.g., ['temp', 'rho'])
+    mass_grid : []
+        1D mass grid to map onto
+    t_idxs : [int]
+        subset of timestep indices to map (default: all)
+    t_weights : []
+        time interpolation weights, as returned by resample_stencil
+    path : str
+        path to SNEC Data directory containing .xg files
+    kind : str
+        interpolation method (see map_snec_grid)
+    out : 3D array
+        optional buffer of shape (n_mass, n_time, n_vars) to write into
+    cache_path : str
+        directory of the profile cache (see load_snec_xg_cached)
+    """
+    snec_mass_grid = None
+    stencil = None
+
+    for j, var in enumerate(var_list):
+        print(f'Mapping var={var} profile from snec onto stir mass grid')
+        profile, _, var_mass_grid = load_snec_xg_cached(var, path=path,
+                                                        cache_path=cache_path,
+                                                        verbose=False)
+        profile = resample_profile(profile, t_idxs=t_idxs, t_weights=t_weights)
+
+        if snec_mass_grid is None:
+            snec_mass_grid = g2msun * var_mass_grid
+            if kind != 'pchip':
+                stencil = interp_stencil(snec_mass_grid, mass_grid)
+
+            shape = (len(mass_grid), len(profile), len(var_list))
+            if out is None:
+                out = np.full(shape, np.nan)
+            elif out.shape != shape:
+                raise ValueError(f'out has shape {out.shape}, expected {shape}')
+
+        elif not np.array_equal(g2msun * var_mass_grid, snec_mass_grid):
+            raise ValueError(f'mass grid of var={var} differs from var={var_list[0]}')
+
+        mapped = interp_profile(profile, x=snec_mass_grid, x_new=mass_grid,
+                                kind=kind, stencil=stencil)
+        out[:, :, j] = mapped.T
+
+    return out
+
+
+def load_snec_profile(var, path=None, mmap_mode='r', t_idxs=None,
+                      t_window=None, time_grid=None):
     """Load precomputed SNEC profiles from file
+
+    The file is memory-mapped (read-only by default), so that when t_idxs
+    or t_window are given only the requested rows are read from disk
+
+    parameters
+    ----------
+    var : str
+        profile variable (e.g., 'temp', 'time_grid')
+    path : str
+        path to directory containing {var}.npy
+    mmap_mode : str or None
+        memory-map mode (see np.load), use None to load fully into memory
+    t_idxs : [int] or slice
+        timestep indices (rows) to load
+    t_window : [t_start, t_end]
+        time range to load (inclusive). Overrides t_idxs
+    time_grid : []
+        time grid of profile, used with t_window. Defaults to time_grid.npy
     """
+    if path is None:
+        path = snec_path
+
     filename = f'{var}.npy'
     filepath = os.path.join(path, filename)
-    return np.load(filepath)
+    profile = np.load(filepath, mmap_mode=mmap_mode)
+
+    if t_window is not None:
+        if time_grid is None:
+            time_grid = load_snec_profile('time_grid', path=path)
+        t_idxs = window_idxs(time_grid, t_window=t_window)
+
+    if t_idxs is not None:
+        profile = np.array(profile[t_idxs])
+
+    return profile
+
+
+def window_idxs(time_grid, t_window):
+    """Returns slice of time_grid covering the given time window (inclusive)
+
+    parameters
+    ----------
+    time_grid : []
+    t_window : [t_start, t_end]
+    """
+    i_start = np.searchsorted(time_grid, t_window[0], side='left')
+    i_end = np.searchsorted(time_grid, t_window[1], side='right')
+    return slice(i_start, i_end)
+
+
+def load_snec_xg_cached(var, path=None, cache_path=None, mmap_mode='r',
+                        t_idxs=None, t_window=None, verbose=True):
+    """Load SNEC profile for var, only parsing the .xg file if not cached
+        Returns: profile, time_grid, mass_grid
+
+    On first access the .xg file is parsed and saved as {var}.npy (profile)
+    and {var}_grids.npz (time_grid, mass_grid) in cache_path. The cache is
+    keyed by the .xg path, mtime and size, and is rebuilt if any change.
+    If the cache can't be written (e.g. a read-only Data directory), the
+    parsed arrays are returned in memory
+
+    parameters
+    ----------
+    var : str
+        profile variable (e.g., 'temp'), loaded from {var}.xg
+    path : str
+        path to SNEC Data directory containing .xg files
+    cache_path : str
+        directory for cached files, defaults to {path}/cache
+    mmap_mode : str or None
+        memory-map mode for the cached profile (see np.load)
+    t_idxs : [int] or slice
+        timestep indices (rows) of the profile to load
+    t_window : [t_start, t_end]
+        time range of the profile to load (inclusive). Overrides t_idxs
+    verbose : bool
+    """
+    if path is None:
+        path = snec_path
+    if cache_path is None:
+        cache_path = os.path.join(path, 'cache')
+
+    xg_filepath = os.path.join(path, f'{var}.xg')
+    profile_filepath = os.path.join(cache_path, f'{var}.npy')
+    grids_filepath = os.path.join(cache_path, f'{var}_grids.npz')
+
+    def build():
+        profile_dict = load_snec_xg(xg_filepath, verbose=verbose)
+        profile, time_grid, mass_grid = reduce_snec_profile(profile_dict)
+        printv(f'Saving profile cache: {profile_filepath}', verbose)
+        return profile, {'time_grid': time_grid, 'mass_grid': mass_grid}
 
+    profile, grids = load_cached_array(profile_filepath, grids_filepath,
+                                       key=file_fingerprint(xg_filepath),
+                                       build_func=build, mmap_mode=mmap_mode)
+    time_grid = grids['time_grid']
+    mass_grid = grids['mass_grid']
 
-def map_snec_grid(var, mass_grid):
+    if t_window is not None:
+        t_idxs = window_idxs(time_grid, t_window=t_window)
+    if t_idxs is not None:
+        profile = np.array(profile[t_idxs])
+
+    return profile, time_grid, mass_grid
+
+
+def map_snec_grid(var, mass_grid, t_idxs=None, path=None, kind='linear',
+                  cache_path=None):
     """Interpolate snec profile onto stir tracer mass grid
 
     parameters
@@ -96,22 +518,104 @@ def map_snec_grid(var, mass_grid):
         profile variable to map (e.g., radius)
     mass_grid : []
         1D mass grid to map onto
+    t_idxs : [int]
+        subset of timestep indices to map (default: all)
+    path : str
+        path to SNEC Data directory containing .xg files
+    kind : str
+        interpolation method, one of:
+        'linear' : linear in value
+        'log' : linear in log10(value), for strictly positive profiles
+        'pchip' : monotone cubic (scipy PchipInterpolator)
+    cache_path : str
+        directory of the profile cache (see load_snec_xg_cached)
     """
     print(f'Mapping var={var} profile from snec onto stir mass grid')
-    snec_mass_grid = g2msun * load_snec_profile('mass_grid')
-    snec_profile = load_snec_profile(f'sub_{var}')
+    snec_profile, _, snec_mass_grid = load_snec_xg_cached(var, path=path,
+                                                          cache_path=cache_path,
+                                                          t_idxs=t_idxs,
+                                                          verbose=False)
+    snec_mass_grid = g2msun * snec_mass_grid
 
-    n_time = len(snec_profile[:, 0])
-    n_mass = len(mass_grid)
-    mapped = np.full((n_time, n_mass), np.nan)
+    return interp_profile(snec_profile, x=snec_mass_grid, x_new=mass_grid,
+                          kind=kind)
+
+
+def interp_profile(profile, x, x_new, kind='linear', stencil=None):
+    """Interpolate every timestep (row) of a 2D profile onto a new grid at once
+        Returns: 2D np.array of shape (n_time, len(x_new))
+
+    parameters
+    ----------
+    profile : 2D array
+        profile of shape (n_time, len(x))
+    x : []
+        1D grid of profile (must be increasing)
+    x_new : []
+        1D grid to interpolate onto (must lie within x)
+    kind : str
+        'linear', 'log', or 'pchip' (see map_snec_grid)
+    stencil : (idxs, weights)
+        precomputed output of interp_stencil(x, x_new), for linear/log kinds
+    """
+    if kind == 'pchip':
+        check_interp_bounds(x, x_new)
+        return PchipInterpolator(x, profile, axis=1, extrapolate=False)(x_new)
+
+    if kind not in ('linear', 'log'):
+        raise ValueError(f"kind='{kind}' must be one of 'linear', 'log', 'pchip'")
+
+    if stencil is None:
+        stencil = interp_stencil(x, x_new)
+    idxs, weights = stencil
+
+    y_lo = profile[:, idxs]
+    y_hi = profile[:, idxs + 1]
 
-    for i in range(n_time):
-        snec_func = interp1d(snec_mass_grid, snec_profile[i, :])
-        mapped[i, :] = snec_func(mass_grid)
+    if kind == 'log':
+        y_lo = np.log10(y_lo)
+        y_hi = np.log10(y_hi)
+
+    mapped = y_lo + weights * (y_hi - y_lo)
+
+    if kind == 'log':
+        mapped = 10**mapped
 
     return mapped
 
 
+def interp_stencil(x, x_new):
+    """Returns bracketing indices and weights for linear interpolation from
+    grid x onto x_new, which can be reused for any profile on the same grids
+        Returns: idxs, weights
+
+    parameters
+    ----------
+    x : []
+        1D grid (must be increasing)
+    x_new : []
+        1D grid to interpolate onto (must lie within x)
+    """
+    x = np.asarray(x)
+    x_new = np.asarray(x_new)
+    check_interp_bounds(x, x_new)
+
+    idxs = np.searchsorted(x, x_new, side='right') - 1
+    idxs = np.clip(idxs, 0, len(x) - 2)
+
+    x_lo = x[idxs]
+    weights = (x_new - x_lo) / (x[idxs + 1] - x_lo)
+
+    return idxs, weights
+
+
+def check_interp_bounds(x, x_new):
+    """Raise ValueError if x_new extends outside of x (as interp1d does)
+    """
+    if np.min(x_new) < x[0] or np.max(x_new) > x[-1]:
+        raise ValueError('A value in x_new is outside the interpolation range.')
+
+
 def reduce_snec_profile(profile_dict):
     """Reduce given profile dictionary into a 2D nparray
         Returns: profile_array, timesteps, mass_grid
@@ -135,56 +639,321 @@ def reduce_snec_profile(profile_dict):
     return profile_array, timesteps, mass_grid
 
 
-def load_snec_xg(filepath, verbose=True):
+def load_snec_xg(filepath, chunk_size=64*1024*1024, verbose=True):
     """Load mass tracers from SNEC output .xg file, returns as dict
 
+    The file is read once, in large byte blocks, and each timestep is parsed
+    in a single call, writing straight into one (n_time, n_mass, 2) array.
+    The array is sized from the byte length of the first timestep (all
+    timesteps have the same number of rows), and grown geometrically if
+    that estimate is exceeded. The dict values are views into that array.
+
     parameters
     ----------
     filepath : str
+    chunk_size : int
+        number of bytes to read per block
     verbose : bool
     """
     printv(f'Loading: {filepath}', verbose)
-    n_lines = fast_line_count(filepath)
+    file_size = os.path.getsize(filepath)
+
+    timesteps = []
+    data = None
+    count = 0
+    progress_time = 0.0
+    bytes_read = 0
+
+    with open(filepath, 'rb') as rf:
+        buf = b''
+        while True:
+            chunk = rf.read(chunk_size)
+            bytes_read += len(chunk)
+            buf += chunk
+            start = find_xg_header(buf, 0)
+
+            # parse every timestep that is followed by another header
+            while start != -1:
+                end = find_xg_header(buf, buf.find(b'Time', start) + 4)
+                if end == -1 and chunk:
+                    break
+
+                block = buf[start:end] if end != -1 else buf[start:]
+                timestep, rows = parse_xg_block(block)
+
+                if data is None:
+                    n_mass = len(rows)
+                    n_time = file_size // len(block) + 1
+                    data = np.empty((n_time, n_mass, 2))
+                elif len(rows) != n_mass:
+                    raise ValueError(f'timestep {timestep} has {len(rows)} rows, '
+                                     f'expected {n_mass}')
+
+                if count == len(data):
+                    data = np.concatenate([data, np.empty_like(data)])
+
+                data[count] = rows
+                timesteps += [timestep]
+                count += 1
+                start = end
+
+            if not chunk:
+                break
+
+            # keep unparsed text, including a header split across blocks
+            buf = buf[start:] if start != -1 else buf[-3:]
+
+            now = time.time()
+            if now - progress_time > 0.25:
+                printv(f'\r{100 * bytes_read / file_size:.1f}%', verbose, end='')
+                progress_time = now
+
+    printv('\r100.0%\n', verbose)
 
     profile = {}
-    with open(filepath, 'r') as rf:
-        count = 0
-        for line in rf:
-            printv(f'\r{100 * count / n_lines:.1f}%', verbose, end='')
-            cols = line.split()
-
-            # Beginning of time data - make key for this time
-            if 'Time' in line:
-                timesteps = float(cols[-1])
-                profile[timesteps] = []
-
-            # In time data -- build x,y arrays
-            elif len(cols) == 2:
-                profile[timesteps].append(np.fromstring(line, sep=' '))
-
-            # End of time data (blank line) -- make list into array
-            else:
-                profile[timesteps] = np.array(profile[timesteps])
-            count += 1
+    for i, timestep in enumerate(timesteps):
+        profile[timestep] = data[i]
 
-    printv('\n', verbose)
     return profile
 
 
-def subset_snec_profile(profile, t_end, dt):
+def find_xg_header(buf, pos):
+    """Returns index of the start of the next 'Time' header line in buf
+        Returns -1 if there is none
+
+    parameters
+    ----------
+    buf : bytes
+    pos : int
+        index to start searching from
+    """
+    idx = buf.find(b'Time', pos)
+    if idx == -1:
+        return -1
+    return buf.rfind(b'\n', 0, idx) + 1
+
+
+def parse_xg_block(block):
+    """Parse a single timestep block from a SNEC .xg file
+        Returns: timestep, 2D np.array of (mass, value) rows
+
+    parameters
+    ----------
+    block : bytes
+        text from a 'Time' header up to (not including) the next one
+    """
+    header_end = block.find(b'\n')
+    if header_end == -1:
+        header_end = len(block)
+
+    timestep = float(block[:header_end].split()[-1])
+    rows = np.fromstring(block[header_end + 1:], sep=' ')
+
+    if len(rows) % 2 != 0:
+        raise ValueError(f'timestep {timestep} has an incomplete row')
+
+    return timestep, rows.reshape(-1, 2)
+
+
+def fast_time_count(filepath):
+    """Efficiently find the number of timesteps in a SNEC .xg file
+
+    parameters
+    ----------
+    filepath: str
+    """
+    count = 0
+    buf_size = 1024 * 1024
+    tail = b''
+
+    with open(filepath, 'rb') as f:
+        read_f = f.raw.read
+        buf = read_f(buf_size)
+
+        while buf:
+            # keep a few bytes so headers split across buffers are counted
+            buf = tail + buf
+            count += buf.count(b'Time')
+            tail = buf[-3:]
+            buf = read_f(buf_size)
+
+    return count
+
+
+def subset_snec_profile(profile, t_end, dt, method='right',
+                        full_time_grid=None, path=None, var='temp',
+                        cache_path=None):
     """Returns subset of profile for given timestep
+
+    parameters
+    ----------
+    profile : 2D array
+    t_end : float
+    dt : float
+    method : str
+        time resampling method (see resample_stencil)
+    full_time_grid : []
+        time grid of profile. Defaults to the (cached) time grid of the
+        run at path, see time_resampler
+    path, var, cache_path : str
+        passed to time_resampler
+    """
+    _, t_idxs, t_weights = subset_stencil(t_end, dt=dt, method=method,
+                                          full_time_grid=full_time_grid,
+                                          path=path, var=var,
+                                          cache_path=cache_path)
+    return resample_profile(profile, t_idxs=t_idxs, t_weights=t_weights)
+
+
+def subset_idxs(t_end, dt, full_time_grid=None, path=None, var='temp',
+                cache_path=None):
+    """Returns indices for subset time grid (see subset_snec_profile)
+    """
+    return subset_stencil(t_end, dt=dt, full_time_grid=full_time_grid,
+                          path=path, var=var, cache_path=cache_path)[1]
+
+
+def subset_stencil(t_end, dt, method='right', full_time_grid=None, path=None,
+                   var='temp', cache_path=None):
+    """Returns resampling stencil from the given full_time_grid, or else
+    from the cached time grid of the run at path (see time_resampler)
+    """
+    if full_time_grid is None:
+        return time_resampler(t_end, dt, path=path, var=var, method=method,
+                              cache_path=cache_path)
+    return resample_stencil(full_time_grid, t_end=t_end, dt=dt, method=method)
+
+
+def time_resampler(t_end, dt, path=None, var='temp', method='right',
+                   cache_path=None, unique=False):
+    """Returns time resampling stencil for the SNEC time grid of a given run
+        Returns: time_grid, t_idxs, t_weights
+
+    The full time grid is loaded once and the stencil for each
+    (t_end, dt, method) is computed once, then reused until the .xg file
+    changes. Returned arrays are read-only.
+
+    parameters
+    ----------
+    t_end : float
+    dt : float
+    path : str
+        path to SNEC Data directory containing .xg files
+    var : str
+        variable whose .xg file provides the time grid
+    method : str
+        time resampling method (see resample_stencil)
+    cache_path : str
+        directory of the profile cache (see load_snec_xg_cached)
+    unique : bool
+        drop repeated timesteps (see resample_stencil)
+    """
+    if path is None:
+        path = snec_path
+    key = file_fingerprint(os.path.join(path, f'{var}.xg'))
+    return cached_time_resampler(t_end, dt, path=path, var=var,
+                                 method=method, key=key, cache_path=cache_path,
+                                 unique=unique)
+
+
+@functools.lru_cache(maxsize=64)
+def cached_time_resampler(t_end, dt, path, var, method, key, cache_path=None,
+                          unique=False):
+    """Cached resample_stencil for time_resampler (key invalidates the cache)
+    """
+    full_time_grid = cached_time_grid(path=path, var=var, key=key,
+                                      cache_path=cache_path)
+    stencil = resample_stencil(full_time_grid, t_end=t_end, dt=dt,
+                               method=method, unique=unique)
+
+    for array in stencil:
+        if array is not None:
+            array.flags.writeable = False
+
+    return stencil
+
+
+@functools.lru_cache(maxsize=8)
+def cached_time_grid(path, var, key, cache_path=None):
+    """Cached full SNEC time grid for time_resampler (key invalidates the cache)
     """
-    t_idxs = subset_idxs(t_end, dt=dt)
-    return profile[t_idxs, :]
+    _, time_grid, _ = load_snec_xg_cached(var, path=path, cache_path=cache_path,
+                                          verbose=False)
+    time_grid.flags.writeable = False
+    return time_grid
+
 
+def resample_stencil(full_time_grid, t_end, dt, method='right', unique=False):
+    """Returns indices and weights to resample a profile onto a uniform
+    time grid from 0 to t_end
+        Returns: time_grid, t_idxs, t_weights
 
-def subset_idxs(t_end, dt):
-    """Returns indices for subset time grid
+    parameters
+    ----------
+    full_time_grid : []
+        time grid of profile
+    t_end : float
+    dt : float
+    method : str
+        one of:
+        'right' : first timestep at or after each time (t_weights is None)
+        'nearest' : nearest timestep to each time (t_weights is None)
+        'interp' : linear interpolation between neighbouring timesteps
+    unique : bool
+        for 'right' and 'nearest', keep a timestep selected more than once
+        (where dt is finer than the profile cadence) only once, so the
+        returned time grid is strictly increasing (as needed to join
+        tracers), but may be shorter than t_end/dt + 1
     """
-    full_time_grid = load_snec_profile('time_grid')
     n_dt = int(t_end / dt)
     time_grid = np.linspace(0, t_end, n_dt+1)
-    return np.searchsorted(full_time_grid, time_grid)
+
+    if method == 'right':
+        t_idxs = np.searchsorted(full_time_grid, time_grid)
+        if unique:
+            t_idxs = np.unique(t_idxs)
+        return full_time_grid[t_idxs], t_idxs, None
+
+    elif method == 'nearest':
+        t_idxs = np.searchsorted(full_time_grid, time_grid)
+        t_idxs = np.clip(t_idxs, 1, len(full_time_grid) - 1)
+        left_closer = (time_grid - full_time_grid[t_idxs - 1]
+                       < full_time_grid[t_idxs] - time_grid)
+        t_idxs[left_closer] -= 1
+        if unique:
+            t_idxs = np.unique(t_idxs)
+        return full_time_grid[t_idxs], t_idxs, None
+
+    elif method == 'interp':
+        t_idxs, t_weights = interp_stencil(full_time_grid, time_grid)
+        return time_grid, t_idxs, t_weights
+
+    else:
+        raise ValueError(f"method='{method}' must be one of "
+                         "'right', 'nearest', 'interp'")
+
+
+def resample_profile(profile, t_idxs=None, t_weights=None):
+    """Returns profile resampled in time, as given by resample_stencil
+
+    Only the required rows are read if profile is memory-mapped
+
+    parameters
+    ----------
+    profile : 2D array
+    t_idxs : [int]
+        timestep indices (default: all)
+    t_weights : []
+        interpolation weights between t_idxs and t_idxs+1
+    """
+    if t_idxs is None:
+        return profile
+    if t_weights is None:
+        return np.array(profile[t_idxs])
+
+    lo = profile[t_idxs]
+    hi = profile[t_idxs + 1]
+    return lo + t_weights[:, np.newaxis] * (hi - lo)
 
 
 def fast_line_count(filepath):
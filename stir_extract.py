@@ -1,8 +1,18 @@
 import os
+import io
+import glob
+import time
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from scipy.optimize import curve_fit
 
+# local
+try:
+    from .caching import file_fingerprint, load_cached_array, save_cache_meta
+except ImportError:  # imported as a top-level module, e.g. by stir_pipeline.py
+    from caching import file_fingerprint, load_cached_array, save_cache_meta
+
 # adapted from https://github.com/snaphu-msu/ecRateStudy
 
 
@@ -11,32 +21,69 @@ def load_last_dats(output_path):
     return pd.read_csv(out_filepath)
 
 
-def get_dat_filepaths(masses, models_path):
+def get_dat_filepaths(masses, models_path,
+                      dat_template='stir2_14may19_s{mass}_alpha1.25.dat'):
+    """dat_template may contain glob wildcards, e.g. 'stir2_*_s{mass}_*.dat'.
+    If there isn't exactly one match, the unmatched pattern is returned
+
+    masses : [str or flt]
+        the same mass token is used for the run_{mass} directory and the
+        filename, so pass strings (see find_masses) to match directory
+        names exactly, e.g. '31' rather than 31.0
+    """
     filenames = {}
     for mass in masses:
         mpath = os.path.join(models_path, f'run_{mass}')
-        fname = f'stir2_14may19_s{mass}_alpha1.25.dat'
+        fname = dat_template.format(mass=mass)
         filenames[mass] = os.path.join(mpath, fname)
 
+        if glob.has_magic(fname):
+            matches = glob.glob(filenames[mass])
+            if len(matches) == 1:
+                filenames[mass] = matches[0]
 
-def get_bounce_time(masses, filenames):
-    bouncetimes = {}
+    return filenames
 
-    for mass in masses:
-        bouncetimes[mass] = {}
-        logname = filenames[mass][:-4] + ".log"
 
-        for line in open(logname, 'r'):
-            if "Bounce!" in line:
-                bouncetimes[mass]["tbounce"] = float(line.split()[1])
+def find_masses(models_path, pattern='run_*'):
+    """Return masses of model directories named run_{mass}, sorted by value
+        Returns: [str], the directory suffixes as written (e.g. '31', '9.25')
+    """
+    masses = []
+    for dirpath in glob.glob(os.path.join(models_path, pattern)):
+        name = os.path.basename(dirpath)
+        if os.path.isdir(dirpath) and name.startswith('run_'):
+            try:
+                float(name[4:])
+            except ValueError:
+                continue
+            masses += [name[4:]]
+
+    return sorted(masses, key=float)
+
+
+def get_bounce_time(masses, filenames, n_workers=8):
+    """n_workers : int
+        number of .log files to scan concurrently
+    """
+    bouncetimes = {}
+    lognames = [filenames[mass][:-4] + ".log" for mass in masses]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        tbounces = executor.map(read_bounce_time, lognames)
 
-        print(mass, bouncetimes[mass]["tbounce"])
+        for mass, tbounce in zip(masses, tbounces):
+            bouncetimes[mass] = {"tbounce": tbounce}
+            print(mass, bouncetimes[mass]["tbounce"])
 
     return bouncetimes
 
 
-def extract_last_dats(masses, filenames, var_list=None):
+def extract_last_dats(masses, filenames, var_list=None, n_workers=8):
     """Extract last line of .dat files
+
+    n_workers : int
+        number of files to read concurrently
     """
     print('Extracting last lines of .dat files')
 
@@ -56,19 +103,17 @@ def extract_last_dats(masses, filenames, var_list=None):
     for var in var_list:
         arrays[var] = np.full(n_masses, np.nan)
 
-    for i, mass in enumerate(masses):
-        print(f'\rmass: {mass} ({100 * (i + 1) / n_masses:.1f}%)', end='')
+    filepaths = [filenames[mass] for mass in masses]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        tails = executor.map(load_tail, filepaths)
 
-        # find last line
-        with open(filenames[mass], "rb") as f:
-            f.seek(-2, os.SEEK_END)
-            while f.read(1) != b"\n":
-                f.seek(-2, os.SEEK_CUR)
-            last = f.readline()
+        for i, (mass, last) in enumerate(zip(masses, tails)):
+            print(f'\rmass: {mass} ({100 * (i + 1) / n_masses:.1f}%)', end='')
 
-        # get vars from last line
-        for var, idx in var_list.items():
-            arrays[var][i] = float(last.split()[idx])
+            # get vars from last line
+            for var, idx in var_list.items():
+                arrays[var][i] = last[-1, idx]
 
     print('')
 
@@ -79,9 +124,58 @@ def extract_last_dats(masses, filenames, var_list=None):
     return last_dats
 
 
+def load_tail(filepath, n_rows=1, block_size=8192):
+    """Return last n_rows of a whitespace-delimited table as 2D array
+
+    See read_tail_lines
+    """
+    lines = read_tail_lines(filepath, n_lines=n_rows, block_size=block_size)
+    return np.array([line.split() for line in lines], dtype=float)
+
+
+def read_tail_lines(filepath, n_lines=1, block_size=8192):
+    """Return last n_lines non-blank lines of a file (as bytes)
+
+    The file is read backwards in blocks. Trailing blank lines are ignored,
+    and a final line without a newline is dropped if it has fewer fields
+    than the line before (i.e. it is still being written)
+    """
+    with open(filepath, 'rb') as f:
+        pos = f.seek(0, os.SEEK_END)
+        data = b''
+
+        while pos > 0:
+            read_size = min(block_size, pos)
+            pos -= read_size
+            f.seek(pos)
+            data = f.read(read_size) + data
+            block_size *= 2
+
+            # first line may be cut off, so need one extra
+            if data.count(b'\n') > n_lines + 1 and count_lines(data) > n_lines + 1:
+                break
+
+    lines = data.split(b'\n')
+    if pos > 0:
+        lines = lines[1:]
+
+    lines = [line for line in lines if line.strip()]
+
+    if (not data.endswith(b'\n')) and len(lines) > 1:
+        if len(lines[-1].split()) < len(lines[-2].split()):
+            lines = lines[:-1]
+
+    return lines[-n_lines:]
+
+
+def count_lines(data):
+    """Return number of non-blank lines in bytes
+    """
+    return sum(1 for line in data.split(b'\n') if line.strip())
+
+
 def get_max_data(mass, filenames, column):
-    data = np.loadtxt(filenames[mass], usecols=(column,), unpack=True)
-    return data[-1]
+    return load_tail(filenames[mass])[-1, column]
 
 
 def get_expl_shok(masses, filenames):
@@ -89,7 +183,8 @@ def get_expl_shok(masses, filenames):
 
     for mass in masses:
         expl_dats[mass] = {}
-        time, ener, shok = np.loadtxt(filenames[mass], usecols=(0, 9, 11), unpack=True)
+        data = load_dat_columns(filenames[mass], ['time', 'exp_en', 'rsh_avg'])
+        time, ener, shok = data['time'], data['exp_en'], data['rsh_avg']
         index = np.max(np.where(ener < 1.e49))
 
         expl_dats[mass]['rmax'] = np.max(shok)
@@ -104,8 +199,9 @@ def get_extra_ener(masses, filenames):
     for mass in masses:
         extra_ener[mass] = {}
 
-        time, ener = np.loadtxt(filenames[mass], usecols=(0, 9), unpack=True)
-        ener /= 1e51
+        data = load_dat_columns(filenames[mass], ['time', 'exp_en'])
+        time = data['time']
+        ener = data['exp_en'] / 1e51
         max_ener = ener[-1]
 
         extra_ener[mass]['finalEner'] = max_ener
@@ -113,12 +209,437 @@ def get_extra_ener(masses, filenames):
 
         params = curve_fit(quadratic, time, ener)[0]
 
-        extra_ener[mass]['asympTime'] = dquadzero(*params)
+        extra_ener[mass]['asympTime'] = dquadzero(*params[1:])
         extra_ener[mass]['asympEner'] = asymp_ener(*params)
 
     return extra_ener
 
 
+# ================================================================
+#       Single-pass extraction
+# ================================================================
+# column indices of named quantities in STIR .dat files
+dat_columns = {'time': 0,
+               'exp_en': 9,
+               'rsh_avg': 11,
+               'dens_c': 16,
+               'pns_mass': 20}
+
+
+def extract_dats(masses, filenames, quantities=None, n_workers=1,
+                 errors='raise'):
+    """Extract summary quantities from .dat files, reading each file once
+        Returns: pd.DataFrame with one row per mass
+
+    quantities : [str]
+        names from dat_quantities, or 'last_{col}'/'max_{col}' for any
+        column name in dat_columns. Defaults to all of dat_quantities
+    n_workers : int
+        number of worker processes (1 runs in serial)
+    errors : 'raise' or 'record'
+        if 'record', a failed mass gets NaN quantities and its error message
+        in an 'error' column, instead of stopping the extraction
+    """
+    if quantities is None:
+        quantities = list(dat_quantities)
+    if errors not in ('raise', 'record'):
+        raise ValueError(f"errors='{errors}' must be 'raise' or 'record'")
+
+    for quantity in quantities:
+        quantity_columns(quantity)  # check names before starting
+
+    extract_func = extract_dat if errors == 'raise' else extract_dat_safe
+    filepaths = [filenames[mass] for mass in masses]
+    n_masses = len(masses)
+    rows = []
+
+    if n_workers == 1:
+        results = (extract_func(filepath, quantities) for filepath in filepaths)
+        for i, row in enumerate(results):
+            print(f'\rmass: {masses[i]} ({100 * (i + 1) / n_masses:.1f}%)', end='')
+            rows += [row]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = executor.map(extract_func, filepaths,
+                                   [quantities] * n_masses)
+            for i, row in enumerate(results):
+                print(f'\rmass: {masses[i]} ({100 * (i + 1) / n_masses:.1f}%)', end='')
+                rows += [row]
+
+    print('')
+
+    columns = list(quantities)
+    if errors == 'record':
+        columns += ['error']
+
+    table = pd.DataFrame(rows, columns=columns)
+    table.insert(0, 'mass', masses)
+    return table
+
+
+def extract_dat_safe(filepath, quantities):
+    """As extract_dat, but errors are caught and returned under 'error'
+    (None if successful) with NaN quantities
+    """
+    try:
+        out = extract_dat(filepath, quantities)
+        out['error'] = None
+    except Exception as e:
+        out = dict.fromkeys(quantities, np.nan)
+        out['error'] = f'{type(e).__name__}: {e}'
+
+    return out
+
+
+def extract_dat(filepath, quantities):
+    """Compute summary quantities from a single .dat file, in one read.
+    If only 'last_' quantities are requested, only the file tail is read
+        Returns: dict of {quantity: value}
+    """
+    if all(quantity.startswith('last_') for quantity in quantities):
+        last = load_tail(filepath)[-1]
+        return {q: last[dat_columns[q[5:]]] for q in quantities}
+
+    columns = set()
+    for quantity in quantities:
+        columns.update(quantity_columns(quantity))
+
+    data = load_dat_columns(filepath, sorted(columns))
+    out = {}
+
+    for quantity in quantities:
+        if quantity.startswith('last_'):
+            out[quantity] = data[quantity[5:]][-1]
+        elif quantity.startswith('max_'):
+            out[quantity] = np.max(data[quantity[4:]])
+        else:
+            out[quantity] = dat_quantities[quantity][1](data)
+
+    return out
+
+
+def quantity_columns(quantity):
+    """Return column names needed to compute a quantity
+    """
+    for prefix in ('last_', 'max_'):
+        if quantity.startswith(prefix):
+            column = quantity[len(prefix):]
+            if column not in dat_columns:
+                raise ValueError(f"unknown column '{column}' in '{quantity}'")
+            return [column]
+
+    if quantity not in dat_quantities:
+        raise ValueError(f"unknown quantity '{quantity}'")
+
+    return dat_quantities[quantity][0]
+
+
+def load_dat_columns(filepath, columns, cache=True, cache_path=None):
+    """Load named columns of a .dat file
+        Returns: dict of {column: 1D array}
+
+    columns : [str]
+        names from dat_columns
+    cache : bool
+        read from the binary cache (see load_dat_cached), otherwise parse
+        only the needed columns from text
+    cache_path : str
+        passed to load_dat_cached
+    """
+    col_idxs = [dat_columns[col] for col in columns]
+
+    if cache:
+        table = load_dat_cached(filepath, cache_path=cache_path, return_meta=False)
+        return {col: np.array(table[:, idx]) for col, idx in zip(columns, col_idxs)}
+
+    table = pd.read_csv(filepath, sep=r'\s+', header=None, usecols=col_idxs,
+                        comment='#', dtype=np.float64, engine='c',
+                        float_precision='round_trip')
+
+    return {col: table[idx].to_numpy() for col, idx in zip(columns, col_idxs)}
+
+
+# ================================================================
+#       Binary cache
+# ================================================================
+def load_dat_cached(filepath, cache_path=None, return_meta=True):
+    """Load full .dat table from a columnar binary cache, converting it
+    from text if the cache is missing or out of date
+        Returns: table [, meta]
+            table : 2D array (n_steps, n_cols), column-major and memory-mapped,
+                    so each column is contiguous on disk
+            meta : dict with 'tbounce' (bounce time from the matching .log,
+                   NaN if not found), 'columns' (dat_columns names, indices).
+                   Only returned if return_meta=True
+
+    The table is rebuilt if the mtime or size of the .dat changes. tbounce
+    is cached in the same metadata file under its own .log fingerprint, so
+    a growing .log only triggers a re-scan of the .log (and only when meta
+    is requested). If the cache can't be written (e.g. a read-only model
+    directory), the parsed table is returned in memory
+
+    cache_path : str
+        directory for cache files, defaults to {dat directory}/cache
+    return_meta : bool
+    """
+    if cache_path is None:
+        cache_path = os.path.join(os.path.dirname(filepath), 'cache')
+
+    basename = os.path.basename(filepath)
+    table_filepath = os.path.join(cache_path, f'{basename}.npy')
+    meta_filepath = os.path.join(cache_path, f'{basename}.meta.npz')
+    key = file_fingerprint(filepath)
+
+    def build():
+        table = pd.read_csv(filepath, sep=r'\s+', header=None, comment='#',
+                            dtype=np.float64, engine='c',
+                            float_precision='round_trip').to_numpy()
+        meta = {'col_names': list(dat_columns), 'col_idxs': list(dat_columns.values())}
+        return np.asfortranarray(table), meta
+
+    table, meta = load_cached_array(table_filepath, meta_filepath, key=key,
+                                    build_func=build)
+    if not return_meta:
+        return table
+
+    log_filepath = filepath[:-4] + '.log'
+    log_key = ''
+    if os.path.exists(log_filepath):
+        log_key = file_fingerprint(log_filepath)
+
+    if 'log_key' in meta and str(meta['log_key']) == log_key:
+        tbounce = float(meta['tbounce'])
+    else:
+        tbounce = read_bounce_time(log_filepath)
+        meta.update(log_key=np.asarray(log_key), tbounce=np.asarray(tbounce))
+        try:
+            save_cache_meta(meta_filepath, key=key, meta=meta)
+        except OSError:
+            pass
+
+    meta_out = {'tbounce': tbounce,
+                'columns': dict(zip(meta['col_names'].tolist(),
+                                    meta['col_idxs'].tolist()))}
+    return table, meta_out
+
+
+# bounce times by .log file fingerprint, see read_bounce_time
+bounce_cache = {}
+
+
+def read_bounce_time(log_filepath, block_size=1024*1024):
+    """Return bounce time from STIR .log file, or NaN if not found
+
+    The file is searched in raw byte blocks, stopping at the first
+    "Bounce!" line. Results are cached by file fingerprint (path, mtime, size)
+    """
+    if not os.path.exists(log_filepath):
+        return np.nan
+
+    key = file_fingerprint(log_filepath)
+    if key in bounce_cache:
+        return bounce_cache[key]
+
+    tbounce = np.nan
+    with open(log_filepath, 'rb') as f:
+        data = b''
+        while True:
+            buf = f.read(block_size)
+            if not buf:
+                break
+            data += buf
+
+            idx = data.find(b'Bounce!')
+            if idx != -1:
+                # make sure the whole line has been read
+                while data.find(b'\n', idx) == -1 and buf:
+                    buf = f.read(block_size)
+                    data += buf
+
+                line_start = data.rfind(b'\n', 0, idx) + 1
+                line_end = data.find(b'\n', idx)
+                if line_end == -1:
+                    line_end = len(data)
+
+                tbounce = float(data[line_start:line_end].split()[1])
+                break
+
+            # only keep the last (partial) line, which may contain a match
+            data = data[data.rfind(b'\n') + 1:]
+
+    bounce_cache[key] = tbounce
+    return tbounce
+
+
+def get_texp(data):
+    """Time of last step with exp_en below 1e49
+    """
+    index = np.max(np.where(data['exp_en'] < 1.e49))
+    return data['time'][index]
+
+
+def get_asymp(data):
+    """Quadratic fit parameters of exp_en (in 1e51 erg) vs time.
+    Stored in data, so the fit is only done once per file
+    """
+    if 'asymp_params' not in data:
+        data['asymp_params'] = curve_fit(quadratic, data['time'],
+                                         data['exp_en'] / 1e51)[0]
+    return data['asymp_params']
+
+
+# quantity: (required columns, function of data)
+dat_quantities = {
+    'rmax': (['rsh_avg'], lambda data: np.max(data['rsh_avg'])),
+    'texp': (['time', 'exp_en'], get_texp),
+    'Eexp': (['exp_en'], lambda data: np.max(data['exp_en'])),
+    'finalEner': (['exp_en'], lambda data: data['exp_en'][-1] / 1e51),
+    'finalTime': (['time'], lambda data: data['time'][-1]),
+    'asympTime': (['time', 'exp_en'], lambda data: dquadzero(*get_asymp(data)[1:])),
+    'asympEner': (['time', 'exp_en'], lambda data: asymp_ener(*get_asymp(data))),
+}
+
+
+# ================================================================
+#       Live monitoring
+# ================================================================
+def follow_runs(masses, filenames, interval=60, n_polls=None,
+                explosion_threshold=1e49):
+    """Monitor running simulations, yielding an updated summary table
+    after each poll (see poll_runs)
+
+    interval : float
+        seconds between polls
+    n_polls : int
+        stop after this many polls (default: run forever)
+    """
+    state = None
+    count = 0
+
+    while n_polls is None or count < n_polls:
+        if count > 0:
+            time.sleep(interval)
+
+        table, state = poll_runs(masses, filenames, state=state,
+                                 explosion_threshold=explosion_threshold)
+        count += 1
+        yield table
+
+
+def poll_runs(masses, filenames, state=None, explosion_threshold=1e49):
+    """Update running summaries from rows appended to each .dat/.log file
+    since the previous poll
+        Returns: table, state
+            table : pd.DataFrame of current summaries, one row per mass
+            state : pass to the next call to continue from the same offsets
+
+    Only new bytes are read on each poll. If a file shrinks (e.g. a run is
+    restarted), its summary is rebuilt from the start.
+
+    explosion_threshold : float
+        exp_en above which a run is flagged as exploded
+    """
+    if state is None:
+        state = {}
+
+    for mass in masses:
+        if mass not in state:
+            state[mass] = new_run_state()
+        poll_run(state[mass], dat_filepath=filenames[mass],
+                 explosion_threshold=explosion_threshold)
+
+    summary_keys = ['n_steps', 'time', 'exp_en', 'rsh_avg', 'rsh_max',
+                    'exploded', 'tbounce']
+    table = pd.DataFrame([[state[mass][key] for key in summary_keys]
+                          for mass in masses], columns=summary_keys)
+    table.insert(0, 'mass', masses)
+
+    return table, state
+
+
+def new_run_state():
+    """Return empty monitoring state for a single run
+    """
+    return {'dat_offset': 0, 'dat_partial': b'',
+            'log_offset': 0, 'log_partial': b'',
+            'n_steps': 0, 'time': np.nan, 'exp_en': np.nan, 'rsh_avg': np.nan,
+            'rsh_max': np.nan, 'exploded': False, 'tbounce': np.nan}
+
+
+def poll_run(run_state, dat_filepath, explosion_threshold=1e49):
+    """Update monitoring state of a single run in place
+    """
+    # ----- .dat -----
+    new_bytes = read_appended(run_state, dat_filepath, kind='dat')
+    if new_bytes is None:
+        run_state.update(new_run_state())
+        new_bytes = read_appended(run_state, dat_filepath, kind='dat')
+
+    if new_bytes:
+        cols = ['time', 'exp_en', 'rsh_avg']
+        col_idxs = [dat_columns[col] for col in cols]
+        try:
+            table = pd.read_csv(io.BytesIO(new_bytes), sep=r'\s+', header=None,
+                                usecols=col_idxs, comment='#', dtype=np.float64,
+                                engine='c')
+        except pd.errors.EmptyDataError:  # only header/comment lines so far
+            table = []
+
+        if len(table) > 0:
+            data = {col: table[idx].to_numpy() for col, idx in zip(cols, col_idxs)}
+            run_state['n_steps'] += len(table)
+            run_state['time'] = data['time'][-1]
+            run_state['exp_en'] = data['exp_en'][-1]
+            run_state['rsh_avg'] = data['rsh_avg'][-1]
+            run_state['rsh_max'] = np.nanmax([run_state['rsh_max'],
+                                              np.max(data['rsh_avg'])])
+            run_state['exploded'] = bool(run_state['exploded']
+                                         or np.any(data['exp_en'] > explosion_threshold))
+
+    # ----- .log -----
+    if np.isnan(run_state['tbounce']):
+        log_filepath = dat_filepath[:-4] + '.log'
+        new_bytes = read_appended(run_state, log_filepath, kind='log')
+        if new_bytes is None:
+            run_state.update(log_offset=0, log_partial=b'')
+            new_bytes = read_appended(run_state, log_filepath, kind='log')
+
+        if new_bytes:
+            idx = new_bytes.find(b'Bounce!')
+            if idx != -1:
+                line_start = new_bytes.rfind(b'\n', 0, idx) + 1
+                line_end = new_bytes.find(b'\n', idx)
+                run_state['tbounce'] = float(new_bytes[line_start:line_end].split()[1])
+
+
+def read_appended(run_state, filepath, kind):
+    """Return complete lines appended to a file since the last read,
+    and advance the stored offset. Returns None if the file has shrunk
+
+    kind : 'dat' or 'log'
+        which offset in run_state to use
+    """
+    if not os.path.exists(filepath):
+        return b''
+
+    offset = run_state[f'{kind}_offset']
+    if os.path.getsize(filepath) < offset:
+        return None
+
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        new_bytes = f.read()
+
+    run_state[f'{kind}_offset'] = offset + len(new_bytes)
+
+    # hold back the last line until it is complete
+    data = run_state[f'{kind}_partial'] + new_bytes
+    split = data.rfind(b'\n') + 1
+    run_state[f'{kind}_partial'] = data[split:]
+
+    return data[:split]
+
+
 def quadratic(x, a, b, c):
     return a + b * x + c * x ** 2
 
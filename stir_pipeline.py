@@ -1,7 +1,9 @@
 import os
+import argparse
+import pandas as pd
 
 # local
-from stir_extract import extract_last_dats, get_dat_filepaths
+from stir_extract import extract_dats, find_masses, get_dat_filepaths
 
 # adapted from https://github.com/snaphu-msu/ecRateStudy
 
@@ -28,19 +30,73 @@ masses = [9.0, 9.25, 9.5, 9.75,
           29.0, 29.1, 29.2, 29.3, 29.4, 29.5, 29.6, 29.7, 29.8, 29.9,
           30.0, 31, 32, 33, 35, 40, 45, 50, 55, 60, 70, 80, 100, 120]
 
-# models_path = '/mnt/home/john7457/projects/data/stir/run_sukhbold/run_14may19_a1.25'
-# output_path = '/mnt/home/john7457/projects/data/stir/extracted'
+default_models_path = '/Users/zac/projects/data/stir/run_sukhbold/run_14may19_a1.25'
+default_quantities = ['last_time', 'last_exp_en', 'last_rsh_avg',
+                      'last_dens_c', 'last_pns_mass']
 
-# masses = [12.0, 13.0, 19.0]
-models_path = '/Users/zac/projects/data/stir/run_sukhbold/run_14may19_a1.25'
-output_path = '/Users/zac/projects/data/stir/extracted'
 
-# --- Extract last lines of .dat ---
-filepaths = get_dat_filepaths(masses, models_path=models_path)
-last_dats = extract_last_dats(masses, filepaths)
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Extract summary quantities from STIR .dat files for a '
+                    'grid of progenitor masses')
+
+    parser.add_argument('models_paths', nargs='*', default=[default_models_path],
+                        help='model directories containing run_{mass}/ subdirectories')
+    parser.add_argument('-m', '--masses', nargs='+', default=None,
+                        help='masses to extract, as written in the run_{mass} '
+                             'directory names (default: built-in mass list)')
+    parser.add_argument('-g', '--mass_glob', default=None,
+                        help="glob for run directories, e.g. 'run_1*' "
+                             "(overrides --masses)")
+    parser.add_argument('-d', '--dat_template',
+                        default='stir2_14may19_s{mass}_alpha1.25.dat',
+                        help='.dat filename template, may contain glob wildcards')
+    parser.add_argument('-q', '--quantities', nargs='+', default=default_quantities,
+                        help="quantities to extract (see stir_extract.dat_quantities, "
+                             "or 'last_{col}'/'max_{col}')")
+    parser.add_argument('-n', '--n_workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes')
+    parser.add_argument('-o', '--output',
+                        default='/Users/zac/projects/data/stir/extracted/stir_last_dats.csv',
+                        help='output table (.csv or .parquet)')
+
+    args = parser.parse_args(argv)
+    tables = []
+
+    for models_path in args.models_paths:
+        print(f'Models: {models_path}')
+
+        if args.mass_glob is not None:
+            mass_list = find_masses(models_path, pattern=args.mass_glob)
+        elif args.masses is not None:
+            mass_list = args.masses
+        else:
+            mass_list = masses
+
+        filepaths = get_dat_filepaths(mass_list, models_path=models_path,
+                                      dat_template=args.dat_template)
+        table = extract_dats(mass_list, filepaths, quantities=args.quantities,
+                             n_workers=args.n_workers, errors='record')
+
+        if len(args.models_paths) > 1:
+            table.insert(0, 'models_path', os.path.basename(models_path.rstrip('/')))
+
+        failed = table[table['error'].notna()]
+        for row in failed.itertuples():
+            print(f'Failed mass {row.mass}: {row.error}')
+
+        tables += [table]
+
+    table = pd.concat(tables, ignore_index=True)
+    n_failed = table['error'].notna().sum()
+    print(f'Extracted {len(table) - n_failed}/{len(table)} models')
+
+    if args.output.endswith('.parquet'):
+        table.to_parquet(args.output, index=False)
+    else:
+        table.to_csv(args.output, index=False)
+    print(f'Saved: {args.output}')
 
-out_filepath = os.path.join(output_path, 'stir_last_dats.csv')
-last_dats.to_csv(out_filepath, index=False)
 
 # explDats = get_expl_shok(['aprox','lab'], mass, filenames)
 # with open('explDatsEC.json', 'w') as f:
@@ -63,3 +119,7 @@ last_dats.to_csv(out_filepath, index=False)
 #    json.dump(compMu, f)
 
 # pltLandscapeEner(alpha, mass, filenames)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,17 @@
 import os
 import sys
 import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from astropy import units
 
+# local
+try:
+    from .caching import save_atomic
+except ImportError:  # imported as a top-level module
+    from caching import save_atomic
+
 # TODO:
 #   4. save files
 
@@ -12,22 +21,65 @@ g2msun = units.g.to(units.Msun)
 
 def load_all_stir_tracers(n_tracers, run='stir2_oct8_s12.0_alpha1.25',
                           prefix='_tracer', extension='.dat', skiprows=2,
-                          path='/Users/zac/projects/codes/traj_code/data/traj_s12.0_1024'):
+                          path='/Users/zac/projects/codes/traj_code/data/traj_s12.0_1024',
+                          n_workers=None, layout='padded', return_lengths=False):
     """Load all stir tracers and return as single array
+
+    Files are parsed in parallel worker processes. Tracers may have
+    different lengths.
+
+    Returns:
+        layout='padded' : tracers [, lengths]
+            tracers : 3D array of shape (n_tracers, max_n_time, n_var),
+                      NaN-padded beyond the length of each tracer
+            lengths : 1D int array of tracer lengths, if return_lengths=True
+        layout='offsets' : values, offsets
+            values : 2D array of all tracers stacked, shape (total_n_time, n_var)
+            offsets : 1D int array of length n_tracers+1, where tracer i is
+                      values[offsets[i]:offsets[i+1]]
+
+    parameters
+    ----------
+    n_workers : int
+        number of worker processes (defaults to number of cpus)
+    layout : 'padded' or 'offsets'
+    return_lengths : bool
     """
-    t0 = load_stir_traj(0, run=run, prefix=prefix, extension=extension,
-                        path=path, skiprows=skiprows)
-    n_time, n_var = t0.shape
-    tracers = np.full([n_tracers, n_time, n_var], np.nan)
+    if layout not in ('padded', 'offsets'):
+        raise ValueError(f"layout='{layout}' must be 'padded' or 'offsets'")
 
-    for i in range(n_tracers):
-        sys.stdout.write(f'\rloading stir tracer: {i+1}/{n_tracers}')
-        tracer = load_stir_traj(i, run=run, prefix=prefix, extension=extension,
-                                path=path, skiprows=skiprows)
-        tracers[i, :, :] = tracer
+    filepaths = [stir_traj_filepath(i, run=run, prefix=prefix,
+                                    extension=extension, path=path)
+                 for i in range(n_tracers)]
+    tracers = []
+    progress = 0
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for tracer in executor.map(read_traj_txt, filepaths,
+                                   [skiprows] * n_tracers, chunksize=8):
+            tracers += [tracer]
+
+            # only update every ~5%
+            percent = (100 * len(tracers)) // n_tracers
+            if percent >= progress + 5 or len(tracers) == n_tracers:
+                sys.stdout.write(f'\rloading stir tracers: {percent}%')
+                progress = percent
 
     sys.stdout.write('\n')
-    return tracers
+    lengths = np.array([len(tracer) for tracer in tracers])
+
+    if layout == 'offsets':
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        return np.concatenate(tracers), offsets
+
+    n_var = tracers[0].shape[1]
+    padded = np.full([n_tracers, lengths.max(), n_var], np.nan)
+    for i, tracer in enumerate(tracers):
+        padded[i, :lengths[i], :] = tracer
+
+    if return_lengths:
+        return padded, lengths
+    return padded
 
 
 def load_stir_traj(tracer_i, run='stir2_oct8_s12.0_alpha1.25',
@@ -38,20 +90,471 @@ def load_stir_traj(tracer_i, run='stir2_oct8_s12.0_alpha1.25',
     """
     filepath = stir_traj_filepath(tracer_i, run=run, prefix=prefix,
                                   extension=extension, path=path)
-    return np.loadtxt(filepath, skiprows=skiprows)
+    return read_traj_txt(filepath, skiprows=skiprows)
+
+
+def read_traj_txt(filepath, skiprows=2):
+    """Read whitespace-delimited trajectory table with pandas' C parser.
+    Values are identical to np.loadtxt
+        Returns: 2D np.array
+
+    parameters
+    ----------
+    filepath : str
+    skiprows : int
+    """
+    table = pd.read_csv(filepath, sep=r'\s+', header=None, skiprows=skiprows,
+                        comment='#', dtype=np.float64, engine='c',
+                        float_precision='round_trip')
+    return table.to_numpy()
+
+
+def extract_stir_mass_grid(n_traj=100, run='stir2_oct8_s12.0_alpha1.25',
+                           prefix='_tracer', extension='.dat', skiprows=2,
+                           path='/Users/zac/projects/codes/traj_code/data/traj_s12.0_1024',
+                           index_path=None):
+    """Obtain mass grid from stir trajectory file headers (via the run index)
+
+    index_path : str
+        directory for the run index (see load_stir_index)
+    """
+    index = load_stir_index(n_traj, run=run, prefix=prefix, extension=extension,
+                            skiprows=skiprows, path=path, index_path=index_path)
+    return index['mass']
+
+
+def load_stir_index(n_traj, run='stir2_oct8_s12.0_alpha1.25',
+                    prefix='_tracer', extension='.dat', skiprows=2,
+                    path='/Users/zac/projects/codes/traj_code/data/traj_s12.0_1024',
+                    index_path=None, n_workers=8):
+    """Load index of stir trajectory files for a run, (re)building it if
+    missing or if any file has changed size or mtime
+        Returns: dict of 1D arrays with keys:
+            'mass', 'n_rows', 'n_cols', 'size', 'mtime'
+
+    parameters
+    ----------
+    n_traj : int
+    index_path : str
+        directory to save index in (defaults to path). If the index can't
+        be saved (e.g. read-only directory), it is rebuilt on each call
+    n_workers : int
+        number of threads used to read file headers when building
+    """
+    if index_path is None:
+        index_path = path
+
+    filepaths = [stir_traj_filepath(i, run=run, prefix=prefix,
+                                    extension=extension, path=path)
+                 for i in range(n_traj)]
+    index_filepath = os.path.join(index_path, f'{run}_traj_index.npz')
+
+    if os.path.exists(index_filepath):
+        with np.load(index_filepath) as f:
+            index = {key: f[key] for key in f.files}
+
+        if len(index['mass']) == n_traj:
+            stats = [os.stat(filepath) for filepath in filepaths]
+            size = np.array([stat.st_size for stat in stats])
+            mtime = np.array([stat.st_mtime_ns for stat in stats])
+
+            if (np.array_equal(size, index['size'])
+                    and np.array_equal(mtime, index['mtime'])):
+                return index
 
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        entries = list(executor.map(read_traj_header, filepaths,
+                                    [skiprows] * n_traj))
 
-def extract_stir_mass_grid(n_traj=100):
-    """Obtain mass grid from stir trajectory file headers
+    index = {}
+    for j, key in enumerate(['mass', 'n_rows', 'n_cols', 'size', 'mtime']):
+        index[key] = np.array([entry[j] for entry in entries])
+
+    try:
+        save_atomic(index_filepath, np.savez, **index)
+    except OSError:
+        pass
+
+    return index
+
+
+def read_traj_header(filepath, skiprows=2):
+    """Read summary info of a stir trajectory file without parsing the data
+        Returns: mass, n_rows, n_cols, size, mtime
+
+    parameters
+    ----------
+    filepath : str
+    skiprows : int
     """
-    mass_grid = []
-    for i in range(n_traj):
-        filepath = stir_traj_filepath(tracer_i=i)
+    stat = os.stat(filepath)
+    buf_size = 1024 * 1024
+
+    with open(filepath, 'rb') as f:
+        mass = float(f.readline().split()[3])
+        for _ in range(skiprows - 1):
+            f.readline()
+
+        first_row = f.readline()
+        n_cols = len(first_row.split())
+        n_rows = int(len(first_row.strip()) > 0)
+
+        buf = f.read(buf_size)
+        last = first_row[-1:]
+        while buf:
+            n_rows += buf.count(b'\n')
+            last = buf[-1:]
+            buf = f.read(buf_size)
+
+        if first_row.endswith(b'\n') and last != b'\n':
+            n_rows += 1  # final row without newline
+
+    return mass, n_rows, n_cols, stat.st_size, stat.st_mtime_ns
+
+
+def save_tracer_txt(filepath, tracer, fmt='%.10e', delimiter='    ',
+                    header_lines=None, save_npy=False, block_rows=8192):
+    """Save tracer to text file, byte-identical to np.savetxt output
+
+    Rows are formatted block_rows at a time with a single %-format
+    operation, using one row-block format string built up front, so
+    memory use is bounded by the block rather than the whole tracer
+
+    parameters
+    ----------
+    filepath : str
+    tracer : 2D array
+    fmt : str
+    delimiter : str
+    header_lines : [str]
+        lines written verbatim before the data (unlike np.savetxt, no
+        comment prefix is added)
+    save_npy : bool
+        also save a binary copy alongside, with extension .npy
+    block_rows : int
+        number of rows formatted per write
+    """
+    tracer = np.asarray(tracer)
+    if tracer.ndim == 1:
+        tracer = np.atleast_2d(tracer).T  # as np.savetxt
+
+    n_rows, n_cols = tracer.shape
+    row_fmt = delimiter.join([fmt] * n_cols) + '\n'
+    block_fmt = row_fmt * block_rows
+
+    with open(filepath, 'wb') as f:
+        if header_lines is not None:
+            header = ''.join(line.rstrip('\n') + '\n' for line in header_lines)
+            f.write(header.encode('latin1'))
+
+        for start in range(0, n_rows, block_rows):
+            block = tracer[start:start + block_rows]
+            if len(block) < block_rows:
+                block_fmt = row_fmt * len(block)
+            f.write((block_fmt % tuple(block.ravel().tolist())).encode('latin1'))
+
+    if save_npy:
+        np.save(os.path.splitext(filepath)[0] + '.npy', tracer)
+
+
+# ===================================================
+#           Tracer store
+# ===================================================
+def build_tracer_store(n_tracers, run='stir2_oct8_s12.0_alpha1.25',
+                       prefix='_tracer', extension='.dat', skiprows=2,
+                       path='/Users/zac/projects/codes/traj_code/data/traj_s12.0_1024',
+                       store_path=None):
+    """Import per-tracer STIR text files into a single tracer store
+
+    The store is one (n_tracers, n_time, n_var) .npy cube (NaN-padded if
+    tracers have different lengths), plus an index .npz holding the mass
+    coordinate, length, and header lines of each tracer
+
+    parameters
+    ----------
+    n_tracers : int
+    store_path : str
+        directory to save store in (defaults to path)
+    """
+    if store_path is None:
+        store_path = path
+
+    headers = []
+    for i in range(n_tracers):
+        filepath = stir_traj_filepath(i, run=run, prefix=prefix,
+                                      extension=extension, path=path)
         with open(filepath, 'r') as f:
-            line = f.readline()
-            mass_grid += [float(line.split()[3])]
+            headers += [[f.readline().rstrip('\n') for _ in range(skiprows)]]
+
+    mass_grid = np.array([float(header[0].split()[3]) for header in headers])
+    tracers, lengths = load_all_stir_tracers(n_tracers, run=run, prefix=prefix,
+                                             extension=extension,
+                                             skiprows=skiprows, path=path,
+                                             return_lengths=True)
+
+    np.save(store_filepath(run, store_path), tracers)
+
+    np.savez(store_index_filepath(run, store_path), mass_grid=mass_grid,
+             lengths=lengths, headers=np.array(headers, dtype=str))
+
+
+def load_tracer_store(run='stir2_oct8_s12.0_alpha1.25',
+                      store_path='/Users/zac/projects/codes/traj_code/data/traj_s12.0_1024',
+                      mmap_mode='r'):
+    """Load tracer store, memory-mapped by default
+        Returns: tracers, index
+            tracers : 3D array of shape (n_tracers, n_time, n_var)
+            index : dict with keys 'mass_grid', 'lengths', 'headers'
+
+    parameters
+    ----------
+    run : str
+    store_path : str
+    mmap_mode : str or None
+    """
+    tracers = np.load(store_filepath(run, store_path), mmap_mode=mmap_mode)
+
+    with np.load(store_index_filepath(run, store_path)) as f:
+        index = {key: f[key] for key in f.files}
+
+    return tracers, index
+
+
+def load_store_tracer(tracer_i, run='stir2_oct8_s12.0_alpha1.25',
+                      store_path='/Users/zac/projects/codes/traj_code/data/traj_s12.0_1024',
+                      store=None):
+    """Load a single tracer from the tracer store, trimmed to its length
+        Returns: 2D np.array
+
+    parameters
+    ----------
+    tracer_i : int
+    run : str
+    store_path : str
+    store : (tracers, index)
+        already opened store, as returned by load_tracer_store, to reuse
+        across calls (otherwise it is opened from run and store_path)
+    """
+    if store is None:
+        store = load_tracer_store(run=run, store_path=store_path)
+    tracers, index = store
+    return np.array(tracers[tracer_i, :index['lengths'][tracer_i]])
+
+
+def load_store_time_slice(time_i, run='stir2_oct8_s12.0_alpha1.25',
+                          store_path='/Users/zac/projects/codes/traj_code/data/traj_s12.0_1024',
+                          store=None):
+    """Load a single timestep of all tracers from the tracer store
+        Returns: 2D np.array of shape (n_tracers, n_var)
+
+    Tracers shorter than time_i are NaN
+
+    parameters
+    ----------
+    time_i : int
+    run : str
+    store_path : str
+    store : (tracers, index)
+        already opened store (see load_store_tracer)
+    """
+    if store is None:
+        store = load_tracer_store(run=run, store_path=store_path)
+    tracers, _ = store
+    return np.array(tracers[:, time_i])
+
+
+def export_tracer_store(out_path, run='stir2_oct8_s12.0_alpha1.25',
+                        store_path='/Users/zac/projects/codes/traj_code/data/traj_s12.0_1024',
+                        out_run=None, prefix='_tracer', extension='.dat',
+                        fmt='%.16e', delimiter='    ', store=None):
+    """Export tracer store back to per-tracer text files, with their
+    original header lines
+
+    parameters
+    ----------
+    out_path : str
+        directory to write tracer files to
+    run : str
+    store_path : str
+    out_run : str
+        run name of exported files (defaults to run)
+    prefix : str
+    extension : str
+    fmt : str
+        value format. The default keeps full float64 precision, so the
+        exported files read back to the stored values exactly. Use the
+        precision of the original files (e.g. '%.10e') to reproduce them
+    delimiter : str
+    store : (tracers, index)
+        already opened store (see load_store_tracer)
+    """
+    if out_run is None:
+        out_run = run
+    if store is None:
+        store = load_tracer_store(run=run, store_path=store_path)
+
+    tracers, index = store
+    n_tracers = len(tracers)
+
+    for i in range(n_tracers):
+        sys.stdout.write(f'\rexporting stir tracer: {i+1}/{n_tracers}')
+        filepath = stir_traj_filepath(i, run=out_run, prefix=prefix,
+                                      extension=extension, path=out_path)
+        save_tracer_txt(filepath, tracers[i, :index['lengths'][i]], fmt=fmt,
+                        delimiter=delimiter, header_lines=index['headers'][i])
+
+    sys.stdout.write('\n')
+
+
+def store_filepath(run, store_path):
+    """Returns filepath to tracer store cube
+    """
+    return os.path.join(store_path, f'{run}_tracers.npy')
+
+
+def store_index_filepath(run, store_path):
+    """Returns filepath to tracer store index
+    """
+    return os.path.join(store_path, f'{run}_tracers_index.npz')
+
+
+# ===================================================
+#           Lazy tracer access
+# ===================================================
+class StirTracers:
+    """Lazy collection of stir tracers for a run
+
+    Tracers are only loaded when accessed, from the tracer store if one
+    exists (memory-mapped), otherwise from the per-tracer text files. The
+    most recently used tracers are kept in a bounded LRU cache.
+
+    Indexing:
+        tracers[i] : 2D array of tracer i
+        tracers[i, col] : 1D array of column col of tracer i
+        tracers[[i, j]] or tracers[i:j] : list of 2D arrays
+        tracers[[i, j], col] or tracers[i:j, col] : list of 1D arrays
+    """
+    def __init__(self, n_tracers, run='stir2_oct8_s12.0_alpha1.25',
+                 prefix='_tracer', extension='.dat', skiprows=2,
+                 path='/Users/zac/projects/codes/traj_code/data/traj_s12.0_1024',
+                 store_path=None, cache_size=32):
+        """
+        parameters
+        ----------
+        n_tracers : int
+        store_path : str
+            directory of tracer store (defaults to path), see build_tracer_store
+        cache_size : int
+            max number of tracers kept in memory
+        """
+        self.n_tracers = n_tracers
+        self.run = run
+        self.prefix = prefix
+        self.extension = extension
+        self.skiprows = skiprows
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+        if store_path is None:
+            store_path = path
+
+        self.store = None
+        self.lengths = None
+        if os.path.exists(store_filepath(run, store_path)):
+            self.store, store_index = load_tracer_store(run=run,
+                                                        store_path=store_path)
+            if len(self.store) < n_tracers:
+                raise ValueError(f'tracer store {store_filepath(run, store_path)} '
+                                 f'has {len(self.store)} tracers, fewer than '
+                                 f'n_tracers={n_tracers}. Rebuild it with '
+                                 'build_tracer_store, or use a smaller n_tracers')
+            self.lengths = store_index['lengths']
+            self.mass_grid = store_index['mass_grid'][:n_tracers]
+        else:
+            self.mass_grid = extract_stir_mass_grid(n_tracers, run=run,
+                                                    prefix=prefix,
+                                                    extension=extension,
+                                                    skiprows=skiprows,
+                                                    path=path)
+
+    def __len__(self):
+        return self.n_tracers
+
+    def __getitem__(self, key):
+        col = None
+        if isinstance(key, tuple):
+            key, col = key
+
+        if isinstance(key, slice):
+            key = range(*key.indices(self.n_tracers))
+
+        if np.ndim(key) > 0:
+            if col is None:
+                return [self.tracer(i) for i in key]
+            return [self.tracer(i)[:, col] for i in key]
+
+        if col is None:
+            return self.tracer(key)
+        return self.tracer(key)[:, col]
+
+    def tracer(self, tracer_i):
+        """Return 2D array of a single tracer (read-only)
+
+        parameters
+        ----------
+        tracer_i : int
+        """
+        tracer_i = int(tracer_i)
+        if tracer_i < 0:
+            tracer_i += self.n_tracers
+        if not 0 <= tracer_i < self.n_tracers:
+            raise IndexError(f'tracer {tracer_i} out of range for '
+                             f'{self.n_tracers} tracers')
+
+        if tracer_i in self.cache:
+            self.cache.move_to_end(tracer_i)
+            return self.cache[tracer_i]
+
+        if self.store is not None:
+            tracer = self.store[tracer_i, :self.lengths[tracer_i]]
+        else:
+            tracer = load_stir_traj(tracer_i, run=self.run, prefix=self.prefix,
+                                    extension=self.extension,
+                                    skiprows=self.skiprows, path=self.path)
+            tracer.flags.writeable = False
+
+        self.cache[tracer_i] = tracer
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return tracer
+
+    def mass_idxs(self, m_min=-np.inf, m_max=np.inf):
+        """Return indices of tracers with mass coordinate in [m_min, m_max]
+
+        parameters
+        ----------
+        m_min : float
+        m_max : float
+        """
+        return np.where((self.mass_grid >= m_min) & (self.mass_grid <= m_max))[0]
+
+    def mass_range(self, m_min=-np.inf, m_max=np.inf, col=None):
+        """Return tracers with mass coordinate in [m_min, m_max]
+            Returns: list of 2D arrays (or 1D if col given)
 
-    return np.array(mass_grid)
+        parameters
+        ----------
+        m_min : float
+        m_max : float
+        col : int
+            only return this column of each tracer
+        """
+        idxs = self.mass_idxs(m_min=m_min, m_max=m_max)
+        if col is None:
+            return [self.tracer(i) for i in idxs]
+        return [self.tracer(i)[:, col] for i in idxs]
 
 
 def stir_traj_filepath(tracer_i, run='stir2_oct8_s12.0_alpha1.25',